@@ -1,15 +1,36 @@
 import streamlit as st
 import altair as alt
-from pathlib import Path
-import pandas as pd
 
 from search_models import *
 from preprocessing_helpers import *
 from scraping_helpers import *
 from update_dataset import *
+from dataset_store import *
+from update_jobs import *
+from shared_resources import *
 
  
 
+@st.experimental_fragment(run_every=2)
+def update_status(path):
+    """ Polls the latest update job of the dataset, the page is rerun once the job has committed new articles"""
+
+    job = latest_job(path)
+    if job is None:
+        return
+
+    if job.active:
+        st.write(f"Updating the dataset: {job.progress} new articles loaded")
+    elif job.status == "failed":
+        st.error(f"Update failed: {job.error}")
+    else:
+        st.write(f"Update complete: {job.new_rows} new articles")
+        if job.failed:
+            st.warning(f"{job.failed} articles could not be fetched, they are retried by the next update")
+        if dataset_version(path) != st.session_state.get("dataset_version"):
+            st.rerun()
+
+
 def main():
     # Create the app in wide format
     st.set_page_config(layout="wide")
@@ -20,15 +41,16 @@ def main():
     st.write("###### Author: Laurent Bobay")
 
 
-    # Read in and show the dataset
-    path = "../data/processed/*.csv"
-    df = load_df(path)
-    if "df" not in st.session_state:
-        st.session_state.df = df
+    # Show the columns of the dataset used on this page
+    path = DATASET_PATH
+    # The dataset is shared by all sessions, it is reloaded once after an update has committed new articles
+    version = current_version(path)
+    drop_stale_state(st.session_state, path)
+    home_df = shared_home_dataset(version, path)
 
     # Read the aircraft list
     aircraft_path = "aircraft_list.tsv"
-    aircraft_df = pd.read_csv(aircraft_path, sep='\t')
+    aircraft_df = shared_aircraft_list(aircraft_path)
     if "aircraft_df" not in st.session_state:
         st.session_state.aircraft_df = aircraft_df
     
@@ -36,24 +58,21 @@ def main():
 
     st.write("## The Dataset")
     # Show the filtered dataframe
-    st.dataframe(st.session_state.df, column_order=("title", "flight_phase", "from", "to", "text", "occurrence", "url", "created"))
+    st.dataframe(home_df, column_order=HOME_COLUMNS)
 
     # Display the length of the dataset:
-    st.write(f"Length of the dataset: {len(st.session_state.df)}")
+    st.write(f"Length of the dataset: {len(home_df)}")
 
-    # Add a button to update the dataset and reload the page
+    # Add a button to update the dataset, the update runs as a background job and the page polls its status
     if st.button("Update Dataset"):
-        update(path)
-        df = load_df(path)
-
-        st.session_state.df = df
-        st.rerun()
+        start_update_job(path)
+    update_status(path)
 
 
     # Draw Charts
 
     # Compute and sort flight_phase_counts
-    flight_phase_counts = st.session_state.df["flight_phase"].value_counts()
+    flight_phase_counts = home_df["flight_phase"].value_counts()
 
     # If you want to sort by the values in ascending order, use sort_values
     sorted_flight_phase_counts = flight_phase_counts.sort_values(ascending=False)
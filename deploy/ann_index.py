@@ -0,0 +1,178 @@
+"""
+Approximate nearest neighbour indexes for the L2-normalised embedding matrices (FastText and SentenceTransformer).
+All indexes have the same interface: fit(embeddings) and search(query, top_n, mask=None) -> (scores, indices).
+The IVF index only needs numpy and scikit-learn, hnswlib and faiss-cpu are used if they are installed.
+The app searches exactly by default. An ANN backend is only used if it is set with ANN_BACKEND (e.g. ANN_BACKEND=ivf
+ANN_N_PROBE=32), which should only be done after 'python benchmarks.py ann' showed an acceptable recall on the real corpus.
+"""
+
+
+import os
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from search_models import top_k
+
+
+# ANN backend of the app (None: exact search) and the number of clusters scanned by the IVF index
+ANN_BACKEND = os.environ.get("ANN_BACKEND") or None
+ANN_N_PROBE = int(os.environ.get("ANN_N_PROBE", 8))
+
+# Below this number of rows the exact search is fast enough
+ANN_MIN_ROWS = 50000
+
+
+def _exact_top_n(embeddings, query, top_n, rows=None):
+    """ Exact inner product search, optionally restricted to the given rows"""
+
+    if rows is not None:
+        scores = embeddings[rows] @ query
+    else:
+        scores = embeddings @ query
+
+    top, top_scores = top_k(scores, top_n)
+    indices = rows[top] if rows is not None else top
+    return top_scores, indices
+
+
+class ExactIndex:
+    """ Brute-force search over all rows, the reference for the approximate indexes"""
+
+    def fit(self, embeddings):
+        self.embeddings = embeddings
+        return self
+
+    def search(self, query, top_n, mask=None):
+        rows = np.flatnonzero(mask) if mask is not None else None
+        return _exact_top_n(self.embeddings, query, top_n, rows)
+
+
+class IVFIndex:
+    """
+    Inverted file index: a k-means coarse quantiser assigns every row to a cluster,
+    a query only scans the rows of the n_probe clusters with the closest centroids.
+    """
+
+    def __init__(self, n_clusters=None, n_probe=ANN_N_PROBE, random_state=0):
+        self.n_clusters = n_clusters
+        self.n_probe = n_probe
+        self.random_state = random_state
+
+    def fit(self, embeddings):
+        self.embeddings = embeddings
+
+        # About sqrt(n) clusters keeps both the centroid scan and the cluster scans small
+        n_clusters = self.n_clusters or max(1, int(np.sqrt(len(embeddings))))
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=self.random_state, n_init=3, batch_size=4096)
+        labels = kmeans.fit_predict(embeddings)
+
+        # Normalised centroids, so the inner product with the query ranks them by cosine similarity
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.centroids = centroids / norms
+
+        # Rows sorted by cluster, the rows of cluster c are order[offsets[c]:offsets[c + 1]]
+        self.order = np.argsort(labels, kind='stable')
+        self.offsets = np.searchsorted(labels[self.order], np.arange(n_clusters + 1))
+        return self
+
+    def search(self, query, top_n, mask=None):
+        # Clusters by similarity of their centroid, more than n_probe are scanned if those hold fewer than top_n rows
+        ranked = np.argsort(-(self.centroids @ query))
+        n_probe = max(self.n_probe, int(np.searchsorted(np.cumsum(np.diff(self.offsets)[ranked]), top_n)) + 1)
+        probe = ranked[:n_probe]
+        rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+
+        if mask is not None:
+            rows = rows[mask[rows]]
+            # A narrow filter may leave too few candidates in the probed clusters
+            if len(rows) < top_n:
+                return _exact_top_n(self.embeddings, query, top_n, np.flatnonzero(mask))
+
+        return _exact_top_n(self.embeddings, query, top_n, rows)
+
+
+class HNSWIndex:
+    """ Adapter for an hnswlib graph index (pip install hnswlib)"""
+
+    def __init__(self, ef_construction=200, M=16, ef=64):
+        self.ef_construction = ef_construction
+        self.M = M
+        self.ef = ef
+
+    def fit(self, embeddings):
+        import hnswlib
+
+        self.embeddings = embeddings
+        self.index = hnswlib.Index(space='ip', dim=embeddings.shape[1])
+        self.index.init_index(max_elements=len(embeddings), ef_construction=self.ef_construction, M=self.M)
+        self.index.add_items(np.asarray(embeddings, dtype=np.float32), np.arange(len(embeddings)))
+        self.index.set_ef(self.ef)
+        return self
+
+    def search(self, query, top_n, mask=None):
+        top_n = min(top_n, self.index.get_current_count())
+        self.index.set_ef(max(self.ef, top_n))
+        row_filter = (lambda row: bool(mask[row])) if mask is not None else None
+        try:
+            labels, distances = self.index.knn_query(query.reshape(1, -1), k=top_n, filter=row_filter)
+        except RuntimeError:
+            # hnswlib fails if a narrow filter leaves fewer than top_n rows reachable
+            return _exact_top_n(self.embeddings, query, top_n, np.flatnonzero(mask) if mask is not None else None)
+
+        # hnswlib returns 1 - inner product for the 'ip' space
+        return 1 - distances[0], labels[0].astype(int)
+
+
+class FaissIndex:
+    """ Adapter for a faiss HNSW index (pip install faiss-cpu)"""
+
+    def __init__(self, M=32, ef=64):
+        self.M = M
+        self.ef = ef
+
+    def fit(self, embeddings):
+        import faiss
+
+        self.embeddings = embeddings
+        self.index = faiss.IndexHNSWFlat(embeddings.shape[1], self.M, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efSearch = self.ef
+        self.index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+        return self
+
+    def search(self, query, top_n, mask=None):
+        # Oversample when filtering, faiss has no cheap per-query filter for HNSW
+        k = top_n if mask is None else top_n * 4
+        scores, labels = self.index.search(np.ascontiguousarray(query.reshape(1, -1), dtype=np.float32), k)
+        scores, labels = scores[0], labels[0]
+
+        keep = labels >= 0
+        if mask is not None:
+            keep &= mask[np.maximum(labels, 0)]
+            if keep.sum() < top_n:
+                return _exact_top_n(self.embeddings, query, top_n, np.flatnonzero(mask))
+
+        return scores[keep][:top_n], labels[keep][:top_n].astype(int)
+
+
+ANN_BACKENDS = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+    "hnswlib": HNSWIndex,
+    "faiss": FaissIndex,
+}
+
+
+def build_ann_index(embeddings, backend=ANN_BACKEND, min_rows=ANN_MIN_ROWS, **kwargs):
+    """
+    Builds an ANN index of the given backend over the embedding matrix.
+    Returns None if no backend is configured or the matrix has less than min_rows rows, the exact search is used then.
+    """
+
+    if backend is None or embeddings is None or len(embeddings) < min_rows:
+        return None
+
+    print(f"Building {backend} index over {len(embeddings)} embeddings")
+    return ANN_BACKENDS[backend](**kwargs).fit(embeddings)
@@ -0,0 +1,163 @@
+"""
+Batch similarity search: matches a whole list of queries (e.g. the incoming reports of a day) against the dataset.
+The queries are vectorised/encoded as one matrix and scored with matrix-matrix products, in blocks of queries
+so that the dense score block stays below a memory budget. The top_n results per query are written to CSV/Parquet.
+Run from the deploy folder, e.g.: python batch_search.py reports.txt --engine tfidf --top-n 10 --output matches.csv
+"""
+
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from shared_resources import *
+
+
+BATCH_ENGINES = ("tfidf", "fasttext", "st")
+
+# Memory budget of one block of scores (queries x articles, float32)
+BLOCK_BYTES = 256 * 2**20
+
+RESULT_COLUMNS = ["query_id", "query", "rank", "row", "score", "title", "href", "url"]
+
+
+def block_ranges(n_queries, n_rows, block_bytes=BLOCK_BYTES):
+    """ Ranges of queries whose float32 score block (queries x n_rows) fits into block_bytes"""
+
+    block_size = max(1, block_bytes // (4 * max(n_rows, 1)))
+    return [(start, min(start + block_size, n_queries)) for start in range(0, n_queries, block_size)]
+
+
+def batch_top_k(query_matrix, corpus_matrix, top_n, mask=None, block_bytes=BLOCK_BYTES):
+    """
+    Top_n rows of the corpus for every query, scored by the inner product of the rows of query_matrix
+    and corpus_matrix (sparse or dense, both L2-normalised for cosine similarities).
+    Returns 2-D arrays of indices and scores, padded with -1 and -inf where the mask leaves fewer rows.
+    """
+
+    # A sparse x sparse product is almost dense but held as CSR, which takes a multiple of the budget.
+    # Sparse query blocks are made dense instead (vocabulary x queries), the blocks are sized for both
+    is_sparse = hasattr(query_matrix, "toarray")
+    block_width = corpus_matrix.shape[0] + (query_matrix.shape[1] if is_sparse else 0)
+
+    indices = []
+    scores = []
+    for start, end in block_ranges(query_matrix.shape[0], block_width, block_bytes):
+        if is_sparse:
+            block_scores = (corpus_matrix @ query_matrix[start:end].T.toarray()).T
+        else:
+            block_scores = query_matrix[start:end] @ corpus_matrix.T
+        block_indices, block_top_scores = top_k(np.asarray(block_scores), top_n, mask)
+        indices.append(block_indices)
+        scores.append(block_top_scores)
+
+    return np.vstack(indices), np.vstack(scores)
+
+
+def encode_queries(engine, queries, version, path=DATASET_PATH):
+    """ The query matrix and the corpus matrix of an engine"""
+
+    if engine == "tfidf":
+        tv, tv_matrix = shared_tfidf_index(version, path)
+        return tv.transform(queries).astype(np.float32), tv_matrix
+
+    if engine == "fasttext":
+        embeddings = shared_fasttext_embeddings(version, path)
+        if embeddings is None:
+            raise ValueError("No FastText model is trained for the current dataset")
+        model = load_fasttext_model()
+        vectors = np.array([fasttext_query_vector(model, query) for query in queries], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms, embeddings
+
+    if engine == "st":
+        model = load_sentence_transformer(ST_MODEL_NAME)
+        embeddings = shared_st_embeddings(version, path)
+        return model.encode(list(queries), normalize_embeddings=True).astype(np.float32), embeddings
+
+    raise ValueError(f"Unknown engine '{engine}', use one of {', '.join(BATCH_ENGINES)}")
+
+
+def batch_search(engine, queries, top_n=10, filters=None, path=DATASET_PATH, block_bytes=BLOCK_BYTES):
+    """
+    Searches the dataset for every query with one engine.
+    Returns a dataframe with one row per query and result: query_id, query, rank, row, score, title, href, url.
+    """
+
+    queries = [str(query) for query in queries]
+    if not queries:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    start = time.perf_counter()
+    version = current_version(path)
+    df = shared_dataset(version, path)
+    mask = filter_mask(shared_filter_bitmaps(version, path), filters or {}, len(df))
+
+    query_matrix, corpus_matrix = encode_queries(engine, queries, version, path)
+    encoded = time.perf_counter()
+    indices, scores = batch_top_k(query_matrix, corpus_matrix, top_n, mask, block_bytes)
+    searched = time.perf_counter()
+
+    # One result row per (query, rank), the padding of narrow filters is dropped
+    query_ids, ranks = np.nonzero(indices >= 0)
+    rows = indices[query_ids, ranks]
+    articles = df.iloc[rows]
+    results = pd.DataFrame({
+        "query_id": query_ids,
+        "query": np.array(queries, dtype=object)[query_ids],
+        "rank": ranks + 1,
+        "row": rows,
+        "score": scores[query_ids, ranks],
+        "title": articles.title.to_numpy(),
+        "href": articles.href.to_numpy(),
+        "url": articles.url.to_numpy(),
+    })
+
+    print(f"{len(queries)} queries, encoding {encoded - start:.2f} s, scoring {searched - encoded:.2f} s "
+          f"({len(queries) / max(searched - start, 1e-9):.1f} queries/sec)")
+    return results
+
+
+def read_queries(file, column="text"):
+    """ Reads the queries from a text file (one query per line) or from the given column of a csv or parquet file"""
+
+    extension = os.path.splitext(file)[1].lower()
+    if extension == ".csv":
+        return pd.read_csv(file)[column].astype(str).tolist()
+    if extension == ".parquet":
+        return pd.read_parquet(file, columns=[column])[column].astype(str).tolist()
+
+    with open(file, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def write_results(results, output):
+    """ Writes the results as parquet if the output ends with .parquet, otherwise as csv"""
+
+    if output.lower().endswith(".parquet"):
+        results.to_parquet(output, index=False)
+    else:
+        results.to_csv(output, index=False)
+    print(f"Wrote {len(results)} results to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the dataset for every query of a file")
+    parser.add_argument("queries", help="Text file with one query per line, or csv/parquet file with a query column")
+    parser.add_argument("--column", default="text", help="Query column of a csv/parquet file")
+    parser.add_argument("--engine", default="tfidf", choices=BATCH_ENGINES)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--output", default="batch_search_results.csv", help="Output file, .csv or .parquet")
+    parser.add_argument("--path", default=DATASET_PATH, help="Path of the processed dataset")
+    parser.add_argument("--block-mb", type=int, default=BLOCK_BYTES // 2**20, help="Memory budget of one block of scores in MB")
+    for column in FILTER_COLUMNS:
+        parser.add_argument(f"--{column.replace('_', '-')}", dest=column, default=None, help=f"Only search articles with this {column}")
+    args = parser.parse_args()
+
+    filters = {column: getattr(args, column) for column in FILTER_COLUMNS}
+    results = batch_search(args.engine, read_queries(args.queries, args.column), args.top_n, filters, args.path, args.block_mb * 2**20)
+    write_results(results, args.output)
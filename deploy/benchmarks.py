@@ -0,0 +1,255 @@
+"""
+Small benchmarks for the search, preprocessing and scraping functions of the app.
+Run from the deploy folder, e.g.: python benchmarks.py tfidf
+"""
+
+
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from search_models import *
+from preprocessing_helpers import *
+from ann_index import *
+from dataset_store import *
+from scraping_helpers import *
+from update_dataset import get_cities, get_countries
+
+FIXTURE_DIR = "../data/fixtures"
+
+
+def time_it(func, repeat=5):
+    """ Returns the best wall time in milliseconds of 'repeat' calls to func"""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return min(timings)
+
+
+def sparse_nbytes(matrix):
+    """ Memory used by a scipy CSR matrix """
+
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def benchmark_tfidf(df, queries=None, top_n=10):
+    """ Compares memory and query latency of the dense and the sparse tf-idf search"""
+
+    if queries is None:
+        queries = df.normalized_text.sample(5, random_state=0).tolist()
+
+    tv, tv_matrix = train_tfidf(df)
+    dense_matrix = tv_matrix.toarray()
+
+    def dense_search():
+        for query in queries:
+            search_text_vector = tv.transform([query]).toarray()
+            similarity_scores = cosine_similarity(search_text_vector, dense_matrix).flatten()
+            similarity_scores.argsort()[-top_n:][::-1]
+
+    def sparse_search():
+        for query in queries:
+            tfidf_search(query, tv, tv_matrix, top_n=top_n)
+
+    dense_ms = time_it(dense_search) / len(queries)
+    sparse_ms = time_it(sparse_search) / len(queries)
+
+    print(f"Documents: {tv_matrix.shape[0]}, vocabulary: {tv_matrix.shape[1]}, non-zeros: {tv_matrix.nnz}")
+    print(f"Dense matrix:  {dense_matrix.nbytes / 1e6:10.1f} MB, {dense_ms:8.2f} ms/query")
+    print(f"Sparse matrix: {sparse_nbytes(tv_matrix) / 1e6:10.1f} MB, {sparse_ms:8.2f} ms/query")
+
+
+def benchmark_ann(df, embeddings=None, backends=("ivf", "hnswlib", "faiss"), top_n=10, n_queries=100, n_probes=(8, 32, 128)):
+    """
+    Recall@top_n and query latency of the ANN backends against the exact search, the IVF index with every n_probe.
+    Set ANN_BACKEND (and ANN_N_PROBE) for the app only if a backend has an acceptable recall and is clearly faster.
+    """
+
+    if embeddings is None:
+        embeddings = np.asarray(load_fasttext_embeddings())
+
+    # Corpus rows as queries, slightly perturbed so they are not trivially found
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(len(embeddings), n_queries, replace=False)]
+    queries = queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact = ExactIndex().fit(embeddings)
+    truth = [set(exact.search(query, top_n)[1]) for query in queries]
+    exact_ms = time_it(lambda: [exact.search(query, top_n) for query in queries], repeat=3) / n_queries
+
+    print(f"Embeddings: {embeddings.shape}, top_n: {top_n}")
+    print(f"{'exact':>8}: recall 1.000, {exact_ms:8.3f} ms/query")
+
+    for backend in backends:
+        try:
+            start = time.perf_counter()
+            index = build_ann_index(embeddings, backend, min_rows=0)
+            build_s = time.perf_counter() - start
+        except ImportError:
+            print(f"{backend:>8}: not installed")
+            continue
+
+        # The clusters of the IVF index are built once and searched with every n_probe
+        for n_probe in (n_probes if backend == "ivf" else (None,)):
+            name = backend
+            if n_probe is not None:
+                index.n_probe = n_probe
+                name = f"{backend}/{n_probe}"
+            recall = np.mean([len(truth[i] & set(index.search(query, top_n)[1])) / top_n for i, query in enumerate(queries)])
+            ms = time_it(lambda: [index.search(query, top_n) for query in queries], repeat=3) / n_queries
+            print(f"{name:>8}: recall {recall:.3f}, {ms:8.3f} ms/query (build {build_s:.1f} s)")
+
+
+def benchmark_preprocessing(df, n_docs=2000):
+    """ Docs/sec of the per-row preprocess_text against the batch preprocess_texts, and whether both give the same results"""
+
+    texts = df.text.astype(str).sample(min(n_docs, len(df)), random_state=0).tolist()
+    stop_words = nltk.corpus.stopwords.words('english')
+    city_names = [remove_accented_chars(city.lower()) for city in get_cities()]
+    country_names = [remove_accented_chars(country.lower()) for country in get_countries()]
+
+    results = {}
+    def before():
+        results["before"] = [preprocess_text(text, stop_words, city_names, country_names) for text in texts]
+
+    def after():
+        results["after"] = list(zip(*preprocess_texts(texts, stop_words, city_names, country_names)))
+
+    # The per-row function tests every token against the lists of cities and countries, one run is enough
+    before_ms = time_it(before, repeat=1)
+    after_ms = time_it(after, repeat=3)
+
+    print(f"{len(texts)} texts, {len(city_names)} city names, {len(country_names)} country names")
+    print(f"Per row (preprocess_text): {len(texts) / before_ms * 1000:10.1f} docs/sec")
+    print(f"Batch (preprocess_texts):  {len(texts) / after_ms * 1000:10.1f} docs/sec")
+    print(f"Same results: {results['before'] == results['after']}")
+
+
+def benchmark_gazetteer(df, n_docs=2000):
+    """ Texts/sec of get_from_to_airport against the Gazetteer automaton, and whether both find the same cities"""
+
+    texts = df.text.astype(str).sample(min(n_docs, len(df)), random_state=0).tolist()
+    cities, codes = get_cities(with_codes=True)
+
+    start = time.perf_counter()
+    gazetteer = Gazetteer(cities, codes)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    results = {}
+    def before():
+        results["before"] = [get_from_to_airport(text, cities) for text in texts]
+
+    def after():
+        results["after"] = [gazetteer.from_to(text) for text in texts]
+
+    before_ms = time_it(before, repeat=1)
+    after_ms = time_it(after, repeat=3)
+
+    print(f"{len(texts)} texts, {len(cities)} city names, gazetteer built in {build_ms:.0f} ms")
+    print(f"Substring loop (get_from_to_airport): {len(texts) / before_ms * 1000:10.1f} texts/sec")
+    print(f"Gazetteer (Gazetteer.from_to):        {len(texts) / after_ms * 1000:10.1f} texts/sec")
+    print(f"Same results: {results['before'] == results['after']}")
+
+
+def benchmark_query_cache(df, n_queries=500, n_distinct=50, engine="tfidf"):
+    """ Queries/sec of a replayed query log with repeated queries, with and without the query cache, and the hit rate"""
+
+    from search_service import search_queries
+    from query_cache import clear_query_cache, get_query_cache_stats
+
+    # Few queries are asked often: the log draws from n_distinct article snippets with Zipf-like frequencies
+    snippets = df.text.astype(str).str[:300].sample(min(n_distinct, len(df)), random_state=0).tolist()
+    weights = 1 / np.arange(1, len(snippets) + 1)
+    log = np.random.default_rng(0).choice(snippets, size=n_queries, p=weights / weights.sum()).tolist()
+    search_queries(engine, log[:1], 10)  # load the index
+
+    def cold():
+        for query in log:
+            clear_query_cache()
+            search_queries(engine, [query], 10)
+
+    def cached():
+        for query in log:
+            search_queries(engine, [query], 10)
+
+    cold_ms = time_it(cold, repeat=1)
+    clear_query_cache()
+    before = get_query_cache_stats()
+    cached_ms = time_it(cached, repeat=1)
+    after = get_query_cache_stats()
+    hits = after["result_hits"] - before["result_hits"]
+    hit_rate = hits / (hits + after["result_misses"] - before["result_misses"])
+
+    print(f"{len(log)} queries, {len(set(log))} distinct, engine {engine}")
+    print(f"Without cache: {len(log) / cold_ms * 1000:10.1f} queries/sec")
+    print(f"With cache:    {len(log) / cached_ms * 1000:10.1f} queries/sec, result hit rate {hit_rate:.2f}")
+
+
+class SavedPage:
+    """ Stand-in for a requests response of a saved page"""
+
+    def __init__(self, content):
+        self.content = content
+
+
+def benchmark_parsing(fixture_dir=FIXTURE_DIR, repeat=3):
+    """ Pages/sec of the article extraction: one parse per field group with html.parser vs. one parse with HTML_PARSER"""
+
+    pages = []
+    for file in glob.glob(os.path.join(fixture_dir, "*.html")):
+        with open(file, "rb") as f:
+            pages.append(SavedPage(f.read()))
+    if not pages:
+        print(f"No saved pages in {fixture_dir}, see serve_fixtures.save_fixture")
+        return
+
+    def before():
+        for page in pages:
+            get_article(BeautifulSoup(page.content, "html.parser"))
+            get_comments(BeautifulSoup(page.content, "html.parser"))
+
+    def after():
+        for page in pages:
+            parse_article(page)
+
+    before_ms = time_it(before, repeat)
+    after_ms = time_it(after, repeat)
+
+    # The parsers recover broken markup differently, the records must not depend on it
+    different = [
+        page for page in pages
+        if parse_article(BeautifulSoup(page.content, "html.parser")) != parse_article(page)
+    ]
+
+    print(f"{len(pages)} saved pages")
+    print(f"Before (2 parses, html.parser): {len(pages) / before_ms * 1000:8.1f} pages/sec")
+    print(f"After (1 parse, {HTML_PARSER}): {len(pages) / after_ms * 1000:8.1f} pages/sec")
+    print(f"Same records: {not different} ({len(different)} pages differ)")
+
+
+BENCHMARKS = {
+    "tfidf": benchmark_tfidf,
+    "ann": benchmark_ann,
+    "preprocessing": benchmark_preprocessing,
+    "gazetteer": benchmark_gazetteer,
+    "parsing": benchmark_parsing,
+    "query_cache": benchmark_query_cache,
+}
+
+# Benchmarks that don't need the dataset
+NO_DATASET = ("parsing",)
+
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else "tfidf"
+    args = sys.argv[2:] if name in NO_DATASET else [load_dataset(DATASET_PATH)]
+    BENCHMARKS[name](*args)
@@ -0,0 +1,27 @@
+"""
+Builds the search indexes on the processed dataset and saves them to the models folder.
+The app loads the saved indexes at startup, so this only has to run after the dataset changed.
+Run from the deploy folder: python build_indexes.py
+"""
+
+
+from search_models import *
+from dataset_store import *
+
+
+def build_indexes(path):
+    """ Builds (or confirms up to date) all saved search indexes for the dataset at path"""
+
+    df = load_dataset(path)
+
+    data_hash = dataset_hash(df)
+    manifest = read_index_manifest()
+    if manifest is not None and manifest["dataset_hash"] == data_hash:
+        print(f"TF-IDF index is up to date ({data_hash})")
+    else:
+        get_tfidf_index(df)
+        print(f"TF-IDF index saved to {TFIDF_INDEX_DIR} ({data_hash})")
+
+
+if __name__ == "__main__":
+    build_indexes(DATASET_PATH)
@@ -0,0 +1,237 @@
+"""
+Parquet storage of the processed Aviation Herald dataset.
+The dataset is stored with a typed schema: datetimes for 'created'/'updated', real list columns for
+'cities', 'countries', 'comment_authors' and 'comments', and categoricals for 'flight_phase'/'occurrence'.
+
+The dataset is a folder of immutable, time-stamped segments plus a manifest.json listing the segments
+(oldest first) and the href of the newest article. An update only appends a new segment.
+The old csv-chunks or single parquet-file are migrated once with: python dataset_store.py
+"""
+
+
+import ast
+import glob
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+DATASET_PATH = "../data/processed/avherald"
+LEGACY_PARQUET_PATH = "../data/processed/avherald.parquet"
+CSV_PATH = "../data/processed/*.csv"
+
+DATASET_SCHEMA = pa.schema([
+    ("title", pa.string()),
+    ("href", pa.string()),
+    ("text", pa.string()),
+    ("time_author", pa.string()),
+    ("headline", pa.string()),
+    ("comment_authors", pa.list_(pa.string())),
+    ("comments", pa.list_(pa.string())),
+    ("occurrence", pa.dictionary(pa.int32(), pa.string())),
+    ("url", pa.string()),
+    ("author", pa.string()),
+    ("created", pa.timestamp("s")),
+    ("updated", pa.timestamp("s")),
+    ("normalized_text", pa.string()),
+    ("cities", pa.list_(pa.string())),
+    ("countries", pa.list_(pa.string())),
+    ("from", pa.string()),
+    ("to", pa.string()),
+    ("flight_phase", pa.dictionary(pa.int32(), pa.string())),
+])
+
+LIST_COLUMNS = ["comment_authors", "comments", "cities", "countries"]
+DATETIME_COLUMNS = ["created", "updated"]
+CATEGORICAL_COLUMNS = ["occurrence", "flight_phase"]
+
+# Columns shown on the Home page
+HOME_COLUMNS = ["title", "flight_phase", "from", "to", "text", "occurrence", "url", "created"]
+
+
+def to_list(value):
+    """ Converts a list, set or their string representation (as written to the csv-files) into a list of strings"""
+
+    if isinstance(value, str):
+        if value in ("", "NULL", "set()"):
+            return []
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return [value]
+
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return []
+    if isinstance(value, set):
+        return sorted(str(item) for item in value)
+
+    return [str(item) for item in value]
+
+
+def to_table(df):
+    """ Converts a dataset dataframe into a pyarrow table with the dataset schema"""
+
+    df = df.copy()
+    for column in DATASET_SCHEMA.names:
+        if column not in df.columns:
+            df[column] = None
+
+    for column in LIST_COLUMNS:
+        df[column] = df[column].apply(to_list)
+    for column in DATETIME_COLUMNS:
+        df[column] = pd.to_datetime(df[column], errors="coerce")
+
+    # Everything else is stored as string, missing values as null
+    for column in DATASET_SCHEMA.names:
+        if column not in LIST_COLUMNS + DATETIME_COLUMNS:
+            df[column] = df[column].astype(object).where(df[column].notna(), None)
+            df[column] = df[column].apply(lambda x: x if x is None else str(x))
+
+    return pa.Table.from_pandas(df[DATASET_SCHEMA.names], schema=DATASET_SCHEMA, preserve_index=False)
+
+
+def read_manifest(path=DATASET_PATH):
+    """ Returns the manifest of the dataset or None if the dataset does not exist yet"""
+
+    try:
+        with open(os.path.join(path, "manifest.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(manifest, path=DATASET_PATH):
+    """ Replaces the manifest atomically, readers see either the old or the new list of segments"""
+
+    manifest_path = os.path.join(path, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def dataset_version(path=DATASET_PATH):
+    """ Version number of the dataset, increased with every change of the segments"""
+
+    manifest = read_manifest(path)
+    return manifest["version"] if manifest is not None else 0
+
+
+def write_segment(df, path=DATASET_PATH):
+    """ Writes the dataframe as a new immutable segment and returns its manifest entry"""
+
+    os.makedirs(path, exist_ok=True)
+    created = datetime.now(timezone.utc)
+    file_name = f"segment_{created:%Y%m%dT%H%M%S_%f}.parquet"
+
+    table = to_table(df)
+    pq.write_table(table, os.path.join(path, file_name), compression="zstd")
+    print(f"Wrote {table.num_rows} rows to {file_name}")
+
+    return {
+        "file": file_name,
+        "rows": table.num_rows,
+        "newest_href": df.iloc[0].href if len(df) else None,
+        "created": created.isoformat(),
+    }
+
+
+def append_segment(df, path=DATASET_PATH):
+    """ Appends the new articles (newest first) as a new segment, the existing segments are not touched"""
+
+    if len(df) == 0:
+        return read_manifest(path)
+
+    manifest = read_manifest(path) or {"version": 0, "segments": [], "newest_href": None}
+    segment = write_segment(df, path)
+
+    # The segment is complete before the manifest references it
+    manifest["segments"].append(segment)
+    manifest["newest_href"] = segment["newest_href"]
+    manifest["version"] += 1
+    write_manifest(manifest, path)
+
+    return manifest
+
+
+def write_dataset(df, path=DATASET_PATH):
+    """ Writes the full dataset (newest first) as a single segment, replacing all existing segments"""
+
+    old_manifest = read_manifest(path)
+    segment = write_segment(df, path)
+
+    manifest = {
+        "version": old_manifest["version"] + 1 if old_manifest is not None else 1,
+        "segments": [segment],
+        "newest_href": segment["newest_href"],
+    }
+    write_manifest(manifest, path)
+
+    # Remove the replaced segments only once the new manifest is in place
+    if old_manifest is not None:
+        for old_segment in old_manifest["segments"]:
+            os.remove(os.path.join(path, old_segment["file"]))
+
+
+def compact_dataset(path=DATASET_PATH):
+    """ Merges all segments into one, e.g. after many small updates"""
+
+    write_dataset(load_dataset(path), path)
+
+
+def load_dataset(path=DATASET_PATH, columns=None):
+    """
+    Loads the dataset (newest articles first), optionally only the given columns.
+    If the dataset does not exist yet, the old csv-chunks or parquet-file are migrated first.
+    """
+
+    manifest = read_manifest(path)
+    if manifest is None:
+        migrate_to_segments(path)
+        manifest = read_manifest(path)
+
+    # Newer segments hold newer articles, so they come first
+    files = [os.path.join(path, segment["file"]) for segment in reversed(manifest["segments"])]
+    columns = list(columns) if columns is not None else None
+    frames = [pd.read_parquet(file, columns=columns) for file in files]
+    if len(frames) == 1:
+        return frames[0]
+
+    # Segments have their own categories, concatenating them falls back to strings
+    df = pd.concat(frames, ignore_index=True)
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+
+    return df
+
+
+def migrate_to_segments(path=DATASET_PATH, legacy_path=LEGACY_PARQUET_PATH, csv_path=CSV_PATH):
+    """ One-time migration of the single parquet-file or, if there is none, the csv-chunks to the segmented dataset"""
+
+    if os.path.exists(legacy_path):
+        print(f"Migrating {legacy_path} to {path}")
+        df = pd.read_parquet(legacy_path)
+    else:
+        df = read_csv_chunks(csv_path)
+
+    write_dataset(df, path)
+    return df
+
+
+def read_csv_chunks(csv_path=CSV_PATH):
+    """ Reads the chunked csv-files (chunk_1.csv, chunk_2.csv, ...) of the old dataset format"""
+
+    # Sort the chunks by their number, so the row order (newest first) is kept
+    file_list = sorted(glob.glob(csv_path), key=lambda file: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', file)])
+    print(f"Migrating {file_list}")
+
+    return pd.concat([pd.read_csv(file) for file in file_list], ignore_index=True)
+
+
+if __name__ == "__main__":
+    migrate_to_segments()
@@ -0,0 +1,68 @@
+"""
+Offline job that embeds the processed dataset with the SentenceTransformer on CPU.
+Only articles missing from the embedding store are embedded. The texts are sorted by length
+to reduce padding, encoded in batches on a pool of worker processes and every block is
+written to the store as soon as it is done.
+Run from the deploy folder, e.g.: python embed_corpus.py --processes 4 --batch-size 64
+"""
+
+
+import argparse
+import time
+
+from dataset_store import *
+from embedding_store import *
+
+
+def embed_corpus(df, model_name=ST_MODEL_NAME, store_dir=None, processes=4, batch_size=64, block_size=2048):
+    """ Embeds all articles of df missing from the store of the model (see embedding_store_dir). Returns the throughput in docs/sec"""
+
+    store_dir = store_dir or embedding_store_dir(model_name)
+    new_df = missing_rows(df, store_dir).drop_duplicates(["href", "text_hash"])
+    if len(new_df) == 0:
+        print("All embeddings are up to date")
+        return 0.
+
+    # Sort by text length: texts in the same batch are then padded to similar lengths
+    new_df = new_df.iloc[new_df.text.astype(str).str.len().argsort(kind="stable")]
+
+    model = load_sentence_transformer(model_name)
+    pool = model.start_multi_process_pool(["cpu"] * processes) if processes > 1 else None
+
+    print(f"Embedding {len(new_df)} articles with {processes} processes, batch size {batch_size}")
+    start = time.perf_counter()
+    done = 0
+    try:
+        # Blocks are streamed to the store, an interrupted job keeps all finished blocks
+        for block_start in range(0, len(new_df), block_size):
+            block = new_df.iloc[block_start:block_start + block_size]
+            texts = block.text.astype(str).tolist()
+
+            if pool is not None:
+                embeddings = model.encode_multi_process(texts, pool, batch_size=batch_size, normalize_embeddings=True)
+            else:
+                embeddings = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+            append_embeddings(block, embeddings, store_dir)
+
+            done += len(block)
+            elapsed = time.perf_counter() - start
+            print(f"{done}/{len(new_df)} articles, {done / elapsed:.1f} docs/sec")
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+    docs_per_sec = done / (time.perf_counter() - start)
+    print(f"Done: {done} articles in {time.perf_counter() - start:.1f} s ({docs_per_sec:.1f} docs/sec)")
+    return docs_per_sec
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed the processed dataset into the SentenceTransformer embedding store")
+    parser.add_argument("--path", default=DATASET_PATH, help="Path of the processed dataset")
+    parser.add_argument("--model", default=ST_MODEL_NAME)
+    parser.add_argument("--processes", type=int, default=4, help="Number of CPU worker processes")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--block-size", type=int, default=2048, help="Number of articles written to the store at once")
+    args = parser.parse_args()
+
+    embed_corpus(load_dataset(args.path), args.model, processes=args.processes, batch_size=args.batch_size, block_size=args.block_size)
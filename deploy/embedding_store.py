@@ -0,0 +1,138 @@
+"""
+On-disk store for the SentenceTransformer embeddings of the articles, one store folder per model.
+Every article is identified by its href and a hash of its text, so it is only embedded once.
+New embeddings are appended as a new .npy segment, the keys of all segments are kept in keys.parquet.
+"""
+
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+ST_MODEL_NAME = 'all-MiniLM-L6-v2'
+ST_STORE_ROOT = "../models/st_embeddings"
+
+
+def embedding_store_dir(model_name=ST_MODEL_NAME, store_root=ST_STORE_ROOT):
+    """ Store folder of a model, the vectors of different models must never be mixed"""
+
+    return os.path.join(store_root, model_name.replace("/", "__"))
+
+
+ST_STORE_DIR = embedding_store_dir(ST_MODEL_NAME)
+
+# Loaded sentence transformer models, keyed by model name
+_st_models = {}
+
+
+def load_sentence_transformer(model_name=ST_MODEL_NAME):
+    """ Loads the sentence transformer model once per process"""
+
+    if model_name not in _st_models:
+        from sentence_transformers import SentenceTransformer
+        _st_models[model_name] = SentenceTransformer(model_name)
+
+    return _st_models[model_name]
+
+
+def text_hash(text):
+    """ Short hash of an article text, used to detect changed articles"""
+
+    return hashlib.sha1(str(text).encode("utf-8")).hexdigest()[:16]
+
+
+def read_store_keys(store_dir=ST_STORE_DIR):
+    """ Returns the keys (href, text_hash, segment, row) of all stored embeddings"""
+
+    keys_path = os.path.join(store_dir, "keys.parquet")
+    if not os.path.exists(keys_path):
+        return pd.DataFrame({
+            "href": pd.Series(dtype=str),
+            "text_hash": pd.Series(dtype=str),
+            "segment": pd.Series(dtype=np.int64),
+            "row": pd.Series(dtype=np.int64),
+        })
+
+    return pd.read_parquet(keys_path)
+
+
+def append_embeddings(keys, embeddings, store_dir=ST_STORE_DIR):
+    """ Appends the embeddings for the keys (href, text_hash) as a new segment of the store"""
+
+    os.makedirs(store_dir, exist_ok=True)
+    old_keys = read_store_keys(store_dir)
+
+    # Write the segment first, the keys file only references complete segments
+    segment = int(old_keys.segment.max()) + 1 if len(old_keys) else 0
+    np.save(os.path.join(store_dir, f"part_{segment:05d}.npy"), np.asarray(embeddings, dtype=np.float32))
+
+    new_keys = pd.DataFrame({
+        "href": keys.href.values,
+        "text_hash": keys.text_hash.values,
+        "segment": segment,
+        "row": np.arange(len(keys)),
+    })
+    all_keys = pd.concat([old_keys, new_keys], ignore_index=True)
+
+    keys_path = os.path.join(store_dir, "keys.parquet")
+    all_keys.to_parquet(keys_path + ".tmp", index=False)
+    os.replace(keys_path + ".tmp", keys_path)
+
+
+def missing_rows(df, store_dir=ST_STORE_DIR):
+    """ Returns the rows of df that have no embedding in the store yet, with an added 'text_hash' column"""
+
+    keys = read_store_keys(store_dir)
+    df = df.assign(text_hash=df.text.apply(text_hash))
+    stored = pd.MultiIndex.from_frame(keys[["href", "text_hash"]])
+
+    return df[~pd.MultiIndex.from_frame(df[["href", "text_hash"]]).isin(stored)]
+
+
+def update_embedding_store(df, model, store_dir=ST_STORE_DIR, batch_size=64):
+    """ Embeds the articles of df that are not in the store yet and appends them. Returns the number of new embeddings"""
+
+    new_df = missing_rows(df, store_dir).drop_duplicates(["href", "text_hash"])
+    if len(new_df) == 0:
+        print("All embeddings are up to date")
+        return 0
+
+    print(f"Embedding {len(new_df)} new articles...")
+    embeddings = model.encode(new_df.text.astype(str).tolist(), batch_size=batch_size, normalize_embeddings=True, show_progress_bar=True)
+    append_embeddings(new_df, embeddings, store_dir)
+
+    return len(new_df)
+
+
+def get_embeddings(df, store_dir=ST_STORE_DIR):
+    """
+    Returns the stored embeddings in the row order of df.
+    Raises a KeyError if an article of df has not been embedded yet.
+    """
+
+    keys = read_store_keys(store_dir)
+
+    # Segment and row of every (href, text_hash), later entries win
+    keys = keys.drop_duplicates(["href", "text_hash"], keep="last")
+    lookup = pd.DataFrame({"segment": keys.segment.values, "row": keys.row.values}, index=pd.MultiIndex.from_frame(keys[["href", "text_hash"]]))
+
+    wanted = pd.MultiIndex.from_arrays([df.href.values, df.text.apply(text_hash).values])
+    locations = lookup.reindex(wanted)
+    if locations.segment.isna().any():
+        raise KeyError(f"{int(locations.segment.isna().sum())} articles have no embedding yet")
+    segments = locations.segment.values.astype(int)
+    rows = locations.row.values.astype(int)
+
+    # Only the requested rows are gathered from the memory-mapped segments, stale rows are never read
+    matrix = None
+    for segment in np.unique(segments):
+        part = np.load(os.path.join(store_dir, f"part_{segment:05d}.npy"), mmap_mode="r")
+        if matrix is None:
+            matrix = np.empty((len(df), part.shape[1]), dtype=np.float32)
+        selected = np.flatnonzero(segments == segment)
+        matrix[selected] = part[rows[selected]]
+
+    return matrix if matrix is not None else np.zeros((0, 0), dtype=np.float32)
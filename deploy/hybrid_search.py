@@ -0,0 +1,143 @@
+"""
+Hybrid search: the sparse TF-IDF search and a dense search (FastText or SentenceTransformer) each return a bounded
+set of candidates, which are fused by reciprocal-rank fusion or by a weighted sum of min-max normalised scores.
+Optionally only the best fused candidates are re-scored with the SentenceTransformer.
+"""
+
+
+import numpy as np
+
+from shared_resources import *
+from query_cache import *
+
+
+HYBRID_DENSE_ENGINES = ("fasttext", "st")
+FUSION_METHODS = ("rrf", "weighted")
+
+# Candidates taken from every engine, and the rank constant of reciprocal-rank fusion
+HYBRID_CANDIDATES = 100
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses the rankings (lists of row indices, best first) by the sum of 1 / (k + rank) over the rankings.
+    Returns the fused scores and the row indices, best first.
+    """
+
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.) + 1. / (k + rank)
+
+    return sort_fused(fused)
+
+
+def weighted_fusion(results, weights):
+    """
+    Fuses the results [(scores, indices), ...] of several engines by the weighted sum of their scores,
+    min-max normalised per engine. A row missing from the candidates of an engine gets 0 from it.
+    Returns the fused scores and the row indices, best first.
+    """
+
+    fused = {}
+    for (scores, indices), weight in zip(results, weights):
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) == 0:
+            continue
+        low, high = scores.min(), scores.max()
+        normalised = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+        for score, row in zip(normalised, indices):
+            fused[row] = fused.get(row, 0.) + weight * score
+
+    return sort_fused(fused)
+
+
+def positive_candidates(scores, indices):
+    """ The candidates with a score > 0, in their order"""
+
+    scores = np.asarray(scores)
+    keep = scores > 0
+    return scores[keep], np.asarray(indices)[keep]
+
+
+def sort_fused(fused):
+    """ Sorts a {row: score} dict by descending score, ties by row"""
+
+    rows = np.fromiter(fused.keys(), dtype=int, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+    order = np.lexsort((rows, -scores))
+    return scores[order], rows[order]
+
+
+def rerank(search_text, rows, version, path=DATASET_PATH):
+    """ Re-scores the candidate rows by the SentenceTransformer cosine similarity, returns the scores and rows best first"""
+
+    model = load_sentence_transformer(ST_MODEL_NAME)
+    query_vector = model.encode([search_text], normalize_embeddings=True)[0]
+
+    # The stored embeddings are used if they are loaded already, otherwise only the candidates are encoded
+    if has_resource("st_embeddings"):
+        candidate_vectors = shared_st_embeddings(version, path)[rows]
+    else:
+        texts = shared_dataset(version, path).text.iloc[rows].astype(str).tolist()
+        candidate_vectors = model.encode(texts, normalize_embeddings=True)
+
+    indices, scores = top_k(candidate_vectors @ query_vector, len(rows))
+    return scores, rows[indices]
+
+
+def hybrid_search(search_text, version, dense="fasttext", top_n=10, mask=None, fusion="rrf", weights=(0.5, 0.5),
+                  candidates=HYBRID_CANDIDATES, rerank_top=0, path=DATASET_PATH):
+    """
+    Hybrid search of the shared TF-IDF index and the dense engine 'dense' ('fasttext' or 'st'), both limited to
+    'candidates' rows. fusion is 'rrf' or 'weighted' (weights of TF-IDF and the dense engine).
+    With rerank_top > 0, the best rerank_top fused rows are re-scored with the SentenceTransformer.
+    Returns the scores and the indices of the top_n rows. Raises ValueError for an unknown or untrained engine.
+    """
+
+    if dense not in HYBRID_DENSE_ENGINES:
+        raise ValueError(f"Unknown dense engine '{dense}', use one of {', '.join(HYBRID_DENSE_ENGINES)}")
+    if fusion not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion '{fusion}', use one of {', '.join(FUSION_METHODS)}")
+
+    tv, tv_matrix = shared_tfidf_index(version, path)
+    if dense == "fasttext":
+        embeddings = shared_fasttext_embeddings(version, path)
+        if embeddings is None:
+            raise ValueError("No FastText model is trained for the current dataset")
+        model = load_fasttext_model()
+        index = shared_fasttext_ann_index(version, path)
+        encode = lambda texts: [fasttext_query_vector(model, text) for text in texts]
+    else:
+        model = load_sentence_transformer(ST_MODEL_NAME)
+        embeddings = shared_st_embeddings(version, path)
+        index = shared_st_ann_index(version, path)
+        encode = lambda texts: model.encode(list(texts), normalize_embeddings=True)
+
+    def search():
+        # The query vectors are shared with the single-engine searches
+        tfidf_vector = query_vectors("tfidf", [search_text], tv.transform, index_generation("tfidf"))[0]
+        sparse_result = tfidf_vector_search(tfidf_vector, tv_matrix, candidates, mask)
+        query_vector = query_vectors(dense, [search_text], encode, index_generation(dense))[0]
+        dense_result = dense_search(query_vector, embeddings, candidates, mask, index)
+
+        # Candidates without any similarity are padding in row order (or -1 for narrow filters), they get no rank credit
+        sparse_result = positive_candidates(*sparse_result)
+        dense_result = positive_candidates(*dense_result)
+
+        if fusion == "rrf":
+            scores, indices = reciprocal_rank_fusion([sparse_result[1], dense_result[1]])
+        else:
+            scores, indices = weighted_fusion([sparse_result, dense_result], weights)
+
+        if rerank_top > 0 and len(indices):
+            scores, indices = rerank(search_text, indices[:max(rerank_top, top_n)], version, path)
+
+        return scores[:top_n], indices[:top_n]
+
+    # The whole search is cached with its settings, keyed on the generations of the indexes loaded above
+    check_version(version)
+    settings = ("hybrid", dense, fusion, tuple(weights) if fusion == "weighted" else None, candidates, rerank_top)
+    generation = index_generation("tfidf") + index_generation(dense)
+    return cached_result(result_key(settings, search_text, top_n, mask, version, generation), search)
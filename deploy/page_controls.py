@@ -0,0 +1,37 @@
+"""
+Streamlit controls shared by the search pages.
+"""
+
+
+import streamlit as st
+
+from shared_resources import *
+
+
+def filter_controls(df, version):
+    """
+    Shows the flight phase and occurrence filters and the filtered dataset.
+    Returns the selected filters (None for all) and the boolean mask of the filtered rows (None without a filter).
+    """
+
+    # The row ids for the filters are precomputed once, filtering is then only a boolean mask over one global index
+    filter_bitmaps = shared_filter_bitmaps(version)
+
+    flight_phase_options = ["All flight phases"] + list(filter_bitmaps["flight_phase"])
+    selected_flight_phase = st.selectbox("Select flight phase", flight_phase_options)
+    occurrence_options = ["All occurrences"] + list(filter_bitmaps["occurrence"])
+    selected_occurrence = st.selectbox("Select occurrence", occurrence_options)
+
+    filters = {
+        "flight_phase": None if selected_flight_phase == "All flight phases" else selected_flight_phase,
+        "occurrence": None if selected_occurrence == "All occurrences" else selected_occurrence,
+    }
+    mask = filter_mask(filter_bitmaps, filters, len(df))
+    filtered_df = df if mask is None else df[mask]
+
+    # Show the filtered dataframe
+    st.dataframe(filtered_df, column_order=("title", "flight_phase", "text", "occurrence", "url"))
+    st.write(f"Length of full dataset: {len(df)}")
+    st.write(f"Length of filtered dataset: {len(filtered_df)}")
+
+    return filters, mask
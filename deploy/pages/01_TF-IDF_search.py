@@ -4,6 +4,11 @@ from search_models import *
 from preprocessing_helpers import *
 from scraping_helpers import *
 from update_dataset import *
+from dataset_store import *
+from update_jobs import *
+from shared_resources import *
+from page_controls import *
+from search_service import *
 
  
 
@@ -15,24 +20,13 @@ def main():
     # Show the dataset
 
     # Read in the dataset
-    path = "../data/processed/*.csv"
-    # Initialize session state for the dataframe
-    if "df" not in st.session_state:
-        st.session_state.df = load_df(path)
+    # The dataset is shared by all sessions, it is reloaded once after an update has committed new articles
+    version = current_version(DATASET_PATH)
+    drop_stale_state(st.session_state, DATASET_PATH)
+    df = shared_dataset(version)
     
-    # Filter the dataset
-    flight_phase_options = ["All flight phases"] + list(st.session_state.df["flight_phase"].unique())
-    selected_flight_phase = st.selectbox("Select flight phase", flight_phase_options)
-
-    if selected_flight_phase == "All flight phases":
-        filtered_df = st.session_state.df
-    else:
-        filtered_df = st.session_state.df[st.session_state.df.flight_phase == selected_flight_phase]
-
-    # Show the filtered dataframe
-    st.dataframe(filtered_df, column_order=("title", "flight_phase", "text", "occurrence", "url"))
-    st.write(f"Length of full dataset: {len(st.session_state.df)}")
-    st.write(f"Length of filtered dataset: {len(filtered_df)}")
+    # Filter and show the dataset
+    filters, _ = filter_controls(df, version)
 
     
 
@@ -42,21 +36,19 @@ def main():
 
 
     # Initialize session state
-    if 'tfidf_vectorizer' not in st.session_state:
-        st.session_state.tfidf_vectorizer = None
-    if 'tfidf_matrix' not in st.session_state:
-        st.session_state.tfidf_matrix = None
     if 'search_text' not in st.session_state:
         st.session_state.search_text = ""
 
-    # Button to run the TF-IDF vectorizer
-    if st.button("Run TF-IDF Vectorizer"):
-        st.session_state.search_text = ""  # Clear the previous search text
-        st.session_state.tfidf_vectorizer, st.session_state.tfidf_matrix = train_tfidf(filtered_df)
+    # The TF-IDF index of the full dataset is shared by all sessions, it is only rebuilt when the dataset has changed.
+    # With a search service, the page is a thin client and the service holds the index
+    tfidf_vectorizer, tfidf_matrix = None, None
+    if not SEARCH_SERVICE_URL:
+        with st.spinner("Loading TF-IDF index..."):
+            tfidf_vectorizer, tfidf_matrix = shared_tfidf_index(version)
         
 
     # Display the text area only if the TF-IDF vectorizer is initialized
-    if st.session_state.tfidf_vectorizer is not None:
+    if SEARCH_SERVICE_URL or tfidf_vectorizer is not None:
         text = st.text_area(
             label="Your search text",
             value=st.session_state.search_text,  # Ensure the current value is preserved
@@ -73,18 +65,18 @@ def main():
 
         # Button to submit search text
         if st.button("Submit"):
-            if st.session_state.tfidf_vectorizer is not None and st.session_state.tfidf_matrix is not None:
-                top_indices = tfidf_search(st.session_state.search_text, st.session_state.tfidf_vectorizer, st.session_state.tfidf_matrix, top_n=top_n)
+            if SEARCH_SERVICE_URL or (tfidf_vectorizer is not None and tfidf_matrix is not None):
+                # Repeated searches are answered from the query cache shared by all sessions
+                hits, error = page_search("tfidf", st.session_state.search_text, top_n, filters)
+                if error:
+                    st.error(error)
                 # container = st.container()
                 # container.write(f"Found the following top 10 indices: {top_indices}")
                 with st.container():
-                    for idx in top_indices:
-                        title = filtered_df.iloc[idx].title
-                        text = filtered_df.iloc[idx].text[:800]
-                        url = filtered_df.iloc[idx].url
-                        st.write(f"##### {title}")
-                        st.write(text + "...")
-                        st.write(url)
+                    for hit in hits:
+                        st.write(f"##### {hit['title']}")
+                        st.write(hit["text"] + "...")
+                        st.write(hit["url"])
                     
             else:
                 st.error("TF-IDF Vectorizer not initialized. Please run the TF-IDF Vectorizer first.")
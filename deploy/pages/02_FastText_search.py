@@ -4,6 +4,12 @@ from search_models import *
 from preprocessing_helpers import *
 from scraping_helpers import *
 from update_dataset import *
+from dataset_store import *
+from update_jobs import *
+from shared_resources import *
+from page_controls import *
+from search_service import *
+from ann_index import *
 
  
 
@@ -15,26 +21,14 @@ def main():
     # Show the dataset
 
     # Read in the dataset
-    path = "../data/processed/*.csv"
-    # Initialize session state for the dataframe
-    if "df" not in st.session_state:
-        st.session_state.df = load_df(path)
+    # The dataset is shared by all sessions, it is reloaded once after an update has committed new articles
+    version = current_version(DATASET_PATH)
+    drop_stale_state(st.session_state, DATASET_PATH)
+    df = shared_dataset(version)
     
-    # Filter the dataset
-    flight_phase_options = ["All flight phases"] + list(st.session_state.df["flight_phase"].unique())
-    selected_flight_phase = st.selectbox("Select flight phase", flight_phase_options)
-
-    if selected_flight_phase == "All flight phases":
-        filtered_df = st.session_state.df
-        st.session_state.search_text = ""  # Clear the previous search text
-    else:
-        filtered_df = st.session_state.df[st.session_state.df.flight_phase == selected_flight_phase]
-        st.session_state.search_text = ""  # Clear the previous search text
-
-    # Show the filtered dataframe
-    st.dataframe(filtered_df, column_order=("title", "flight_phase", "text", "occurrence", "url"))
-    st.write(f"Length of full dataset: {len(st.session_state.df)}")
-    st.write(f"Length of filtered dataset: {len(filtered_df)}")
+    # Filter and show the dataset
+    filters, _ = filter_controls(df, version)
+    st.session_state.search_text = ""  # Clear the previous search text
     
 
     # FastText Similarity search
@@ -44,21 +38,26 @@ def main():
 
 
     # Initialize session state
-    if 'fast_text_model' not in st.session_state:
-        st.session_state.fast_text_model = None
     if 'search_text' not in st.session_state:
         st.session_state.search_text = ""
 
     # Button to run the TF-IDF vectorizer
-    if st.button("Train FastText model on filtered dataset"):
+    if st.button("Train FastText model on full dataset"):
         # Path to the output text file
         txt_filepath = "../data/interim/text_corpus.txt"
         st.session_state.search_text = ""  # Clear the previous search text
-        st.session_state.fast_text_model = train_fasttext(filtered_df, txt_filepath, model='skipgram')
+        train_fasttext(df, txt_filepath, model='skipgram')
+        # The embeddings and the ANN index of the previous model are rebuilt for all sessions
+        invalidate("fasttext_embeddings")
+        invalidate("fasttext_ann_index")
+
+    # A model trained earlier is used right away, after an update the new dataset is embedded with it first.
+    # With a search service, the page is a thin client and the service holds the embeddings
+    embeddings = None if SEARCH_SERVICE_URL else shared_fasttext_embeddings(version)
         
 
     # Display the text area only if the Fasttext model is trained
-    if st.session_state.fast_text_model:
+    if SEARCH_SERVICE_URL or embeddings is not None:
         text = st.text_area(
             label="Your search text",
             value=st.session_state.search_text,  # Ensure the current value is preserved
@@ -74,20 +73,19 @@ def main():
 
         # Button to submit search text
         if st.button("Submit"):
-            if st.session_state.fast_text_model:
-                model_path = "../models/fasttext_model.bin"
-                # Path to the output text file
-                txt_filepath = "../data/interim/text_corpus.txt"
-                results, top_indices = fasttext_search(st.session_state.search_text, model_path, txt_filepath, top_n=top_n)
+            if SEARCH_SERVICE_URL or embeddings is not None:
+                # Repeated searches are answered from the query cache shared by all sessions,
+                # the approximate nearest neighbour index is only built for large corpora
+                hits, error = page_search("fasttext", st.session_state.search_text, top_n, filters)
+                if error:
+                    st.error(error)
+
                 # Write results to the container
                 with st.container():
-                    for i, result in enumerate(results):
-                        title = filtered_df.iloc[top_indices[i]].title
-                        text = filtered_df.iloc[top_indices[i]].text[:800] + "..."
-                        url = filtered_df.iloc[top_indices[i]].url
-                        st.write(f"##### {title}")
-                        st.write(text)
-                        st.write(url)
+                    for hit in hits:
+                        st.write(f"##### {hit['title']}")
+                        st.write(hit["text"] + "...")
+                        st.write(hit["url"])
                     
             else:
                 st.error("FastText model not trained. Please train FastText model first.")
@@ -1,12 +1,16 @@
-import numpy as np
-from sentence_transformers import SentenceTransformer, util
-
 import streamlit as st
 
 from search_models import *
 from preprocessing_helpers import *
 from scraping_helpers import *
 from update_dataset import *
+from dataset_store import *
+from update_jobs import *
+from shared_resources import *
+from page_controls import *
+from search_service import *
+from embedding_store import *
+from ann_index import *
 
 
 def main():
@@ -17,26 +21,14 @@ def main():
     # Show the dataset
 
     # Read in the dataset
-    path = "../data/processed/*.csv"
-    # Initialize session state for the dataframe
-    if "df" not in st.session_state:
-        st.session_state.df = load_df(path)
+    # The dataset is shared by all sessions, it is reloaded once after an update has committed new articles
+    version = current_version(DATASET_PATH)
+    drop_stale_state(st.session_state, DATASET_PATH)
+    df = shared_dataset(version)
     
-    # Filter the dataset
-    flight_phase_options = ["All flight phases"] + list(st.session_state.df["flight_phase"].unique())
-    selected_flight_phase = st.selectbox("Select flight phase", flight_phase_options)
-
-    if selected_flight_phase == "All flight phases":
-        filtered_df = st.session_state.df
-        st.session_state.search_text = ""  # Clear the previous search text
-    else:
-        filtered_df = st.session_state.df[st.session_state.df.flight_phase == selected_flight_phase]
-        st.session_state.search_text = ""  # Clear the previous search text
-
-    # Show the filtered dataframe
-    st.dataframe(filtered_df, column_order=("title", "flight_phase", "text", "occurrence", "url"))
-    st.write(f"Length of full dataset: {len(st.session_state.df)}")
-    st.write(f"Length of filtered dataset: {len(filtered_df)}")
+    # Filter and show the dataset
+    filters, _ = filter_controls(df, version)
+    st.session_state.search_text = ""  # Clear the previous search text
     
 
     # FastText Similarity search
@@ -46,34 +38,32 @@ def main():
 
 
     # Initialize session state
-    if 'sentence_transformer_model' not in st.session_state:
-        st.session_state.sentence_transformer_model = None
     if 'search_text' not in st.session_state:
         st.session_state.search_text = ""
-    if "new_text_embeddings" not in st.session_state:
-        st.session_state.new_text_embeddings = None
-    if "corpus" not in st.session_state:
-        st.session_state.corpus = None
 
     # Button to run the Sentence Transformer embedding:
-    if st.button("Create Embeddings"):
+    create_embeddings = st.button("Create Embeddings")
+    if create_embeddings:
         st.write("Creating embeddings...")
         # Clear the search text field
         st.session_state.search_text = ""  # Clear the previous search text
 
-        # Load a pre-trained model from sentence-transformers
-        st.session_state.sentence_transformer_model = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        # Generate corpus
-        st.session_state.corpus = filtered_df.text.tolist()
-
-        # Generate embeddings for the texts
-        st.session_state.new_text_embeddings = st.session_state.sentence_transformer_model.encode(st.session_state.corpus)
+    # The model and the embeddings are shared by all sessions. Once created, they are reloaded
+    # for the new dataset after an update, articles missing from the embedding store are embedded first
+    # With a search service, the page is a thin client and the service holds the model and the embeddings
+    sentence_transformer_model = None
+    if not SEARCH_SERVICE_URL and (create_embeddings or has_resource("st_embeddings")):
+        try:
+            sentence_transformer_model = load_sentence_transformer(ST_MODEL_NAME)
+            shared_st_embeddings(version)
+        except ImportError:
+            st.error("sentence-transformers is not installed.")
+            sentence_transformer_model = None
 
         
 
     # Display the text area only if the Sentence-Transformer is initialized
-    if st.session_state.sentence_transformer_model:
+    if SEARCH_SERVICE_URL or sentence_transformer_model is not None:
         st.session_state.search_text = st.text_area(
             label="Your search text",
             value=st.session_state.search_text,  # Ensure the current value is preserved
@@ -85,25 +75,21 @@ def main():
         top_n = st.slider("Select number of results", 0, 50, 10, 5)
         # Button to submit search text
         if st.button("Submit"):
-            if st.session_state.sentence_transformer_model:
-                new_text_embedding = st.session_state.sentence_transformer_model.encode([st.session_state.search_text])
-                # Compute cosine similarity between the new text and the corpus
-                cosine_scores = util.pytorch_cos_sim(new_text_embedding, st.session_state.new_text_embeddings)[0].numpy()
-
-                # Get the indices of the sorted scores in descending order
-                sorted_indices = np.argsort(cosine_scores)[::-1]
+            if SEARCH_SERVICE_URL or sentence_transformer_model is not None:
+                # Get the cosine similarities and indices of the top_n texts within the filter in descending order,
+                # repeated searches are answered from the query cache shared by all sessions.
+                # The approximate nearest neighbour index is only built for large corpora
+                hits, error = page_search("st", st.session_state.search_text, top_n, filters)
+                if error:
+                    st.error(error)
 
-                # Print the sorted similarity scores and corresponding texts
-                print("Texts sorted by similarity to the new text:")
                 # Write results to the container
                 with st.container():
-                    counter = 0
-                    for idx in sorted_indices[:top_n]:
-                        counter += 1
-                        st.write(f"##### {filtered_df.iloc[idx].title}")
-                        st.write(f"{st.session_state.corpus[idx][:800]}...")
-                        st.write(f"Similarity Score: {cosine_scores[idx]:.4f}")
-                        st.write(filtered_df.iloc[idx].url)
+                    for hit in hits:
+                        st.write(f"##### {hit['title']}")
+                        st.write(f"{hit['text']}...")
+                        st.write(f"Similarity Score: {hit['score']:.4f}")
+                        st.write(hit["url"])
 
             else:
                 st.error("No embeddings for the corpus created. Please train FastText model first.")
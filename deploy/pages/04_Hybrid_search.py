@@ -0,0 +1,84 @@
+import streamlit as st
+
+from search_models import *
+from preprocessing_helpers import *
+from dataset_store import *
+from update_jobs import *
+from shared_resources import *
+from page_controls import *
+from search_service import *
+from hybrid_search import *
+
+
+
+def main():
+    # Create title and introduction of the project
+
+    st.write("# Hybrid Search on the Aviation Herald Dataset")
+
+    # Read in the dataset
+    # The dataset is shared by all sessions, it is reloaded once after an update has committed new articles
+    version = current_version(DATASET_PATH)
+    drop_stale_state(st.session_state, DATASET_PATH)
+    df = shared_dataset(version)
+
+    # Filter and show the dataset
+    _, mask = filter_controls(df, version)
+
+
+    # Hybrid search
+    st.write("## Hybrid TF-IDF + Dense Search")
+    st.write("The TF-IDF search and a dense search each return their best candidates, which are fused into one ranking. "
+             "Optionally the best fused candidates are re-scored with the SentenceTransformer.")
+
+    # Initialize session state
+    if 'search_text' not in st.session_state:
+        st.session_state.search_text = ""
+
+    # Search settings
+    dense_engines = {"FastText": "fasttext", "SentenceTransformer": "st"}
+    dense = dense_engines[st.selectbox("Dense engine", list(dense_engines))]
+    fusion_methods = {"Reciprocal-rank fusion": "rrf", "Weighted normalised scores": "weighted"}
+    fusion = fusion_methods[st.selectbox("Fusion", list(fusion_methods))]
+    tfidf_weight = 0.5
+    if fusion == "weighted":
+        tfidf_weight = st.slider("Weight of the TF-IDF scores", 0.0, 1.0, 0.5, 0.05)
+    candidates = st.slider("Candidates per engine", 10, 500, HYBRID_CANDIDATES, 10)
+    rerank_top = st.slider("Re-score the best candidates with the SentenceTransformer (0: off)", 0, 100, 0, 10)
+
+    st.session_state.search_text = st.text_area(
+        label="Your search text",
+        value=st.session_state.search_text,  # Ensure the current value is preserved
+        height=300,
+        max_chars=5000,
+        placeholder="Your search text for similarity search"
+    )
+
+    # Slider to select number of results
+    top_n = st.slider("Select number of results", 0, 50, 10, 5)
+
+    # Button to submit search text
+    if st.button("Submit"):
+        try:
+            with st.spinner("Searching..."):
+                scores, top_indices = hybrid_search(
+                    st.session_state.search_text, version, dense, top_n, mask, fusion,
+                    (tfidf_weight, 1 - tfidf_weight), candidates, rerank_top,
+                )
+        except ValueError as error:
+            st.error(f"{error}. Please train the FastText model on its page first.")
+        except ImportError:
+            st.error("sentence-transformers is not installed.")
+        else:
+            with st.container():
+                for hit in article_hits(df, scores, top_indices):
+                    st.write(f"##### {hit['title']}")
+                    st.write(hit["text"] + "...")
+                    st.write(f"Score: {hit['score']:.4f}")
+                    st.write(hit["url"])
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Multiprocess preprocessing of the dataset, e.g. a full reprocess after a change of the preprocessing rules
+or a large backfill. The dataframe is split into chunks that are preprocessed on a pool of worker processes,
+every worker loads the stopwords, cities and countries once. Finished chunks are written to a staging folder
+right away, so an interrupted run only repeats the unfinished chunks.
+Run from the deploy folder, e.g.: python preprocess_corpus.py --processes 8
+"""
+
+
+import argparse
+import hashlib
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import nltk
+import pandas as pd
+import pyarrow.parquet as pq
+
+from dataset_store import *
+from update_dataset import load_lexicons, preprocess_articles
+
+
+REPROCESS_DIR = "../data/interim/reprocess"
+
+# Lexicons of a worker process, loaded once by _init_worker
+_lexicons = None
+
+
+def _init_worker():
+    global _lexicons
+    _lexicons = load_lexicons(download=False)
+
+
+def _preprocess_chunk(chunk_path, df):
+    """ Preprocesses one chunk in a worker process and writes it to the staging folder"""
+
+    df = preprocess_articles(df.reset_index(drop=True), _lexicons)
+    pq.write_table(to_table(df), chunk_path + ".tmp", compression="zstd")
+    os.replace(chunk_path + ".tmp", chunk_path)
+    return len(df)
+
+
+def chunk_file_name(number, df):
+    """ File name of a staged chunk, it contains a digest of the chunk so chunks of another input are not reused"""
+
+    digest = hashlib.sha1()
+    for href, text in zip(df.href.astype(str), df.text.astype(str)):
+        digest.update(href.encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+
+    return f"chunk_{number:05d}_{digest.hexdigest()[:12]}.parquet"
+
+
+def preprocess_parallel(df, processes=None, chunk_size=2000, staging_dir=REPROCESS_DIR):
+    """
+    Preprocesses the articles of df (see update_dataset.preprocess_articles) on 'processes' worker processes,
+    chunk_size rows at a time. Returns the preprocessed dataframe in the original row order.
+    """
+
+    if len(df) == 0:
+        return df
+
+    processes = processes or os.cpu_count()
+    os.makedirs(staging_dir, exist_ok=True)
+
+    chunks = []
+    for number, start in enumerate(range(0, len(df), chunk_size)):
+        chunk = df.iloc[start:start + chunk_size]
+        chunks.append((os.path.join(staging_dir, chunk_file_name(number, chunk)), chunk))
+
+    # Chunks staged by an interrupted run are kept
+    todo = [(chunk_path, chunk) for chunk_path, chunk in chunks if not os.path.exists(chunk_path)]
+    print(f"Preprocessing {sum(len(chunk) for _, chunk in todo)} articles in {len(todo)} chunks with {processes} processes")
+
+    # The workers read the stopwords from disk, they are downloaded once here
+    nltk.download('stopwords');
+
+    start = time.perf_counter()
+    done = 0
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as executor:
+        # Bound the number of chunks in flight, every submitted chunk is a pickled copy
+        pending = set()
+        for chunk_path, chunk in todo:
+            pending.add(executor.submit(_preprocess_chunk, chunk_path, chunk))
+            while len(pending) >= 2 * processes:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done += sum(future.result() for future in finished)
+                print(f"{done} articles, {done / (time.perf_counter() - start):.1f} docs/sec")
+
+        for future in pending:
+            done += future.result()
+
+    if done:
+        print(f"Done: {done} articles in {time.perf_counter() - start:.1f} s ({done / (time.perf_counter() - start):.1f} docs/sec)")
+
+    return pd.concat([pd.read_parquet(chunk_path) for chunk_path, _ in chunks], ignore_index=True)
+
+
+def reprocess_dataset(path=DATASET_PATH, processes=None, chunk_size=2000, staging_dir=REPROCESS_DIR):
+    """ Preprocesses all articles of the dataset again and replaces the dataset with the result"""
+
+    df = preprocess_parallel(load_dataset(path), processes, chunk_size, staging_dir)
+    write_dataset(df, path)
+
+    # The staged chunks are in the dataset now
+    shutil.rmtree(staging_dir)
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess the full dataset again on several processes")
+    parser.add_argument("--path", default=DATASET_PATH, help="Path of the processed dataset")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes, default: number of CPUs")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Number of articles per chunk")
+    args = parser.parse_args()
+
+    reprocess_dataset(args.path, args.processes, args.chunk_size)
@@ -1,4 +1,5 @@
 import re
+from collections import deque
 from datetime import datetime
 import unicodedata
 import nltk
@@ -13,6 +14,10 @@ import streamlit as st
 def find_occurrence_type(headline):
     """ Input is a string that is normally leaded by the occurrence type"""
 
+    # Pages without a headline
+    if not headline:
+        return None
+
     # Split the headline at colons ":"
     hl_parts = headline.split(":")
 
@@ -115,6 +120,61 @@ def preprocess_text(doc, stop_words, city_names, country_names):
     return doc, found_cities, found_countries
 
 
+# Letters-only, lower case texts are tokenized at the whitespace, except for these words that nltk.word_tokenize splits
+TOKEN_SPLITS = {
+    "cannot": ("can", "not"),
+    "gimme": ("gim", "me"),
+    "gonna": ("gon", "na"),
+    "gotta": ("got", "ta"),
+    "lemme": ("lem", "me"),
+    "wanna": ("wan", "na"),
+}
+NON_LETTERS_PATTERN = re.compile(r'[^a-zA-Z\s]', flags=re.I|re.A)
+WORD_PATTERN = re.compile(r'[a-z]+')
+
+
+def tokenize(doc):
+    """ Regex tokenizer giving the same tokens as nltk.word_tokenize for the lower case, letters-only texts of preprocess_text"""
+
+    tokens = []
+    for token in WORD_PATTERN.findall(doc):
+        split = TOKEN_SPLITS.get(token)
+        if split is None:
+            tokens.append(token)
+        else:
+            tokens.extend(split)
+
+    return tokens
+
+
+def preprocess_texts(texts, stop_words, city_names, country_names):
+    """ 
+    Batch version of preprocess_text for a whole text column, with the same results.
+    The stopwords, cities and countries are compiled into hash sets once, so every token test is O(1).
+    Returns the normalized texts, the found cities and the found countries as 3 lists.
+    """
+
+    stop_words = frozenset(stop_words)
+    city_names = frozenset(city_names)
+    country_names = frozenset(country_names)
+    geo_names = city_names | country_names
+
+    normalized_texts = []
+    found_cities = []
+    found_countries = []
+    for doc in texts:
+        doc = NON_LETTERS_PATTERN.sub(' ', doc).lower()
+
+        # Stopwords and 1 and 2 letter words are removed
+        tokens = [token for token in tokenize(doc) if len(token) > 2 and token not in stop_words]
+
+        found_cities.append({token for token in tokens if token in city_names})
+        found_countries.append({token for token in tokens if token in country_names})
+        normalized_texts.append(' '.join(token for token in tokens if token not in geo_names))
+
+    return normalized_texts, found_cities, found_countries
+
+
 def assign_flight_phase(title, text):
     """ Assign a flight phase to a row """
 
@@ -153,7 +213,9 @@ def list_to_txt(text_list, txt_file):
 
         return 0
 
-def get_from_to_airport(text, city_names):
+def split_from_to(text):
+    """ Returns the parts after 'from' and after 'to' (up to a closing bracket) of the first 300 characters, or None"""
+
     if len(text) > 300:
         sentence = text[:300]
     else:
@@ -161,40 +223,136 @@ def get_from_to_airport(text, city_names):
 
     # Detect the first "from" if any
     sentence = sentence.split("from", 1)
+    if len(sentence) < 2:
+        return None
 
-    if len(sentence) > 1:
-        # Take the part of the sentence after "from"
-        sentence = sentence[1].strip()
+    # Take the part of the sentence after "from" and detect "to" if any
+    sentence = sentence[1].strip().split("to", 1)
+    if len(sentence) < 2:
+        return None
 
-        # Detect "to" if any
-        sentence = sentence.split("to", 1)
+    from_ = sentence[0]
+    to_ = sentence[1].split(")")[0].strip()
+    return from_, to_
 
-        if len(sentence) > 1:
-            from_ = sentence[0]
-            to_ = sentence[1].split(")")[0].strip()
-            from_city = None
-            to_city = None
 
-            # Find from city and break when found
-            for city_name in city_names:
-                if city_name in from_:
-                    from_city = city_name
-                    break
+def get_from_to_airport(text, city_names):
+    parts = split_from_to(text)
+    if parts is None:
+        return None, None
+    from_, to_ = parts
 
-            # Find to city and break when found
-            for city_name in city_names:
-                if city_name in to_:
-                    to_city = city_name
+    from_city = None
+    to_city = None
+
+    # Find from city and break when found
+    for city_name in city_names:
+        if city_name in from_:
+            from_city = city_name
+            break
+
+    # Find to city and break when found
+    for city_name in city_names:
+        if city_name in to_:
+            to_city = city_name
+            break
+
+    return from_city, to_city
+
+
+class Gazetteer:
+    """ 
+    Aho-Corasick automaton over a list of city names, built once.
+    first_match finds the first name in list order that is contained in a text, like a loop of substring
+    tests over the list would, but in a single pass over the text.
+    """
+
+    def __init__(self, names, codes=None):
+        self.names = list(names)
+        self.codes = list(codes) if codes is not None else None
+
+        # Trie of the names: goto[node] maps a character to the next node, first[node] is the
+        # smallest list index of a name ending at this node or at one of its suffixes
+        self.goto = [{}]
+        self.first = [None]
+        for index, name in enumerate(self.names):
+            node = 0
+            for char in name:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.first.append(None)
+                node = next_node
+            if self.first[node] is None:
+                self.first[node] = index
+
+        # Failure links (longest proper suffix in the trie), set breadth first
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            fail_first = self.first[self.fail[node]]
+            if fail_first is not None and (self.first[node] is None or fail_first < self.first[node]):
+                self.first[node] = fail_first
+            for char, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                queue.append(child)
+
+    def first_match(self, text):
+        """ List index of the first name contained in text, or None"""
+
+        goto, fail, first = self.goto, self.fail, self.first
+        best = first[0]  # An empty name is contained in every text
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if first[node] is not None and (best is None or first[node] < best):
+                best = first[node]
+                if best == 0:
                     break
 
-            return from_city, to_city
-        
-        else:
-            return None, None     
-    
-    else:
-        return None, None
-    
+        return best
+
+    def find(self, text):
+        """ The first name in list order contained in text, or None"""
+
+        index = self.first_match(text)
+        return self.names[index] if index is not None else None
+
+    def find_code(self, text):
+        """ The code (e.g. IATA) of the first name in list order contained in text, or None (see from_to_codes)"""
+
+        index = self.first_match(text)
+        return self.codes[index] if index is not None else None
+
+    def from_to(self, text):
+        """ Same result as get_from_to_airport(text, names)"""
+
+        parts = split_from_to(text)
+        if parts is None:
+            return None, None
+        return self.find(parts[0]), self.find(parts[1])
+
+    def from_to_codes(self, text):
+        """
+        The codes of the from and to city of get_from_to_airport.
+        Ambiguous: many city names belong to several airports (Paris, France and Paris, Tennessee), the code of
+        the first airport of the name in the list is returned, e.g. "from Paris to London" gives ('PHT', 'YXU').
+        Use the codes only as a hint, the city names are the reliable result.
+        """
+
+        parts = split_from_to(text)
+        if parts is None:
+            return None, None
+        return self.find_code(parts[0]), self.find_code(parts[1])
+
     
 def load_df(path):
     file_list = glob.glob(path)
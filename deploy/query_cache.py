@@ -0,0 +1,136 @@
+"""
+Bounded caches of the search path, shared by all sessions and by the search service:
+    - query vectors, keyed by engine, normalised query and the generation of the model/index that encoded it
+    - top-k results, keyed by engine, normalised query, top_n, filter mask, dataset version and index generations
+Both caches evict the least recently used entries beyond QUERY_CACHE_SIZE and expire entries after QUERY_CACHE_TTL.
+A rebuilt index gets a new generation (see shared_resources.resource_generation) and a new dataset version
+empties the caches, so no result of an old index is returned. get_query_cache_stats reports the hit rates.
+"""
+
+
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+from cachetools import TTLCache
+
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 2048))
+QUERY_CACHE_TTL = int(os.environ.get("QUERY_CACHE_TTL", 3600))
+
+# cachetools caches are not thread-safe, the Streamlit sessions and the service threads share one lock
+_cache_lock = threading.Lock()
+_vector_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+_result_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+_cache_version = None
+CACHE_STATS = {"vector_hits": 0, "vector_misses": 0, "result_hits": 0, "result_misses": 0}
+
+
+def normalize_query(search_text):
+    """ Collapses whitespace, so that queries only differing in line breaks or spaces share their cache entries"""
+
+    return re.sub(r'\s+', ' ', str(search_text), flags=re.UNICODE).strip()
+
+
+def mask_key(mask):
+    """ Short digest of a boolean filter mask (None for no filter)"""
+
+    if mask is None:
+        return None
+    return hashlib.sha1(np.packbits(np.asarray(mask, dtype=bool)).tobytes()).hexdigest()
+
+
+def check_version(version):
+    """ Empties the caches if the dataset version changed since the last cached search"""
+
+    global _cache_version
+    with _cache_lock:
+        if _cache_version != version:
+            _vector_cache.clear()
+            _result_cache.clear()
+            _cache_version = version
+
+
+def query_vectors(engine, queries, encode, generation):
+    """
+    The query vectors of the queries, encode(texts) is only called for the queries without a cached vector
+    and must return one vector per text. generation identifies the model/index that the vectors belong to.
+    """
+
+    keys = [(engine, normalize_query(query), generation) for query in queries]
+    with _cache_lock:
+        vectors = [_vector_cache.get(key) for key in keys]
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        # Duplicate queries of a batch are only encoded once
+        texts = list(dict.fromkeys(keys[i][1] for i in missing))
+        encoded = dict(zip(texts, encode(texts)))
+        for i in missing:
+            vectors[i] = encoded[keys[i][1]]
+
+    with _cache_lock:
+        CACHE_STATS["vector_hits"] += len(queries) - len(missing)
+        CACHE_STATS["vector_misses"] += len(missing)
+        for i in missing:
+            _vector_cache[keys[i]] = vectors[i]
+
+    return vectors
+
+
+def result_key(engine, search_text, top_n, mask, version, generation):
+    """ Cache key of one search, engine also holds the settings of the search (e.g. the fusion of a hybrid search)"""
+
+    return engine, normalize_query(search_text), int(top_n), mask_key(mask), version, generation
+
+
+def get_result(key):
+    """ Cached (scores, indices) of a search or None"""
+
+    with _cache_lock:
+        result = _result_cache.get(key)
+        CACHE_STATS["result_misses" if result is None else "result_hits"] += 1
+    return result
+
+
+def put_result(key, result):
+    """ Caches the (scores, indices) of a search, the arrays must not be modified afterwards"""
+
+    with _cache_lock:
+        _result_cache[key] = result
+
+
+def cached_result(key, search):
+    """ The cached result of key, or the result of search() which is then cached"""
+
+    result = get_result(key)
+    if result is None:
+        result = search()
+        put_result(key, result)
+    return result
+
+
+def clear_query_cache():
+    """ Empties the caches, e.g. after retraining a model"""
+
+    with _cache_lock:
+        _vector_cache.clear()
+        _result_cache.clear()
+
+
+def get_query_cache_stats():
+    """ Hits, misses, hit rates and sizes of the caches"""
+
+    with _cache_lock:
+        stats = dict(CACHE_STATS)
+        stats["vector_entries"] = len(_vector_cache)
+        stats["result_entries"] = len(_result_cache)
+
+    for cache in ("vector", "result"):
+        lookups = stats[f"{cache}_hits"] + stats[f"{cache}_misses"]
+        stats[f"{cache}_hit_rate"] = stats[f"{cache}_hits"] / lookups if lookups else 0.
+    stats["max_entries"] = QUERY_CACHE_SIZE
+    stats["ttl_seconds"] = QUERY_CACHE_TTL
+    return stats
@@ -1,21 +1,316 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
 import requests
 from bs4 import BeautifulSoup
 
+# lxml parses several times faster than the builtin parser, which is used as fallback
+try:
+    import lxml
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36",
+    "Accept-Encoding": "gzip, deflate",
+}
+
+# On-disk HTTP cache for conditional requests (ETag / Last-Modified)
+HTTP_CACHE_DIR = "../data/interim/http_cache"
+CACHE_STATS = {"hits": 0, "misses": 0, "bytes_saved": 0}
+_stats_lock = threading.Lock()
+
+# Shared session of the concurrent fetcher, its connections are reused by all threads
+_session = None
+_session_lock = threading.Lock()
+
+# Rate limiters and robots.txt rules per host
+_buckets = {}
+_robots = {}
+_hosts_lock = threading.Lock()
 
 
 def load_page(url):
     """ Returns the response for the URL"""
     
     ### Load the first page:
-    page = requests.get(url, headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36"}, timeout=5)
+    page = cached_get(url, timeout=5)
+
+    return page
+
+
+def get_session(pool_size=8):
+    """ Returns the process-wide requests session, its keep-alive connections are reused by all requests and threads"""
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers.update(HEADERS)
+    return _session
+
+
+def _cache_paths(url, cache_dir):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key + ".json"), os.path.join(cache_dir, key + ".body")
+
+
+def _write_atomic(path, data, mode="wb"):
+    with open(path + ".tmp", mode) as file:
+        file.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def _count(hits=0, misses=0, bytes_saved=0):
+    with _stats_lock:
+        CACHE_STATS["hits"] += hits
+        CACHE_STATS["misses"] += misses
+        CACHE_STATS["bytes_saved"] += bytes_saved
+
+
+def get_cache_stats():
+    """ Returns the hit/miss counters, the hit rate and the bytes not downloaded thanks to the cache"""
+
+    with _stats_lock:
+        stats = dict(CACHE_STATS)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.
+    return stats
+
+
+def cached_get(url, timeout=5, cache_dir=HTTP_CACHE_DIR):
+    """ 
+    GET with the shared session and the on-disk HTTP cache.
+    If the page was fetched before, the request is conditional (If-None-Match / If-Modified-Since)
+    and a '304 Not Modified' answer is served from the cache as a normal 200 response.
+    """
+
+    meta_path, body_path = _cache_paths(url, cache_dir)
+    meta = None
+    headers = {}
+    if os.path.exists(meta_path) and os.path.exists(body_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    page = get_session().get(url, headers=headers, timeout=timeout)
+
+    if page.status_code == 304 and meta is not None:
+        with open(body_path, "rb") as file:
+            page._content = file.read()
+        page.status_code = 200
+        page.encoding = meta.get("encoding")
+        _count(hits=1, bytes_saved=len(page._content))
+        return page
+
+    _count(misses=1)
+
+    # Only pages the server can validate later are worth caching
+    etag = page.headers.get("ETag")
+    last_modified = page.headers.get("Last-Modified")
+    if page.status_code == 200 and (etag or last_modified):
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_atomic(body_path, page.content)
+        _write_atomic(meta_path, json.dumps({"url": url, "etag": etag, "last_modified": last_modified, "encoding": page.encoding}), mode="w")
 
     return page
 
+
+class TokenBucket:
+    """ Thread-safe token bucket: on average 'rate' requests per second, bursts of at most 'capacity'"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a request may be sent"""
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """ No request is sent for the next 'seconds' (e.g. after a Retry-After header)"""
+
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def get_robots(root):
+    """ Returns the parsed robots.txt of the host (everything is allowed if there is none)"""
+
+    if root not in _robots:
+        robots = RobotFileParser(root + "/robots.txt")
+        try:
+            response = get_session().get(root + "/robots.txt", timeout=5)
+            robots.parse(response.text.splitlines() if response.status_code == 200 else [])
+        except requests.RequestException:
+            robots.parse([])
+        _robots[root] = robots
+    return _robots[root]
+
+
+def get_bucket(root, rate):
+    """ Returns the rate limiter of the host, the crawl-delay of robots.txt is respected"""
+
+    with _hosts_lock:
+        if root not in _buckets:
+            crawl_delay = get_robots(root).crawl_delay(HEADERS["User-Agent"])
+            if crawl_delay:
+                rate = min(rate, 1 / float(crawl_delay))
+            _buckets[root] = TokenBucket(rate)
+        return _buckets[root]
+
+
+def retry_after_seconds(page):
+    """ Parses the Retry-After header (seconds or HTTP date), returns None if there is none"""
+
+    value = page.headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0., parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_page(url, rate=1.0, retries=3, backoff=1.0, timeout=5):
+    """ 
+    Fetches the URL with the shared session and the rate limit of its host.
+    Timeouts, connection errors, 429 and 5xx responses are retried with exponential backoff.
+    Returns None if robots.txt disallows the URL, all retries failed or the response is another error (e.g. 404).
+    """
+
+    parts = urlsplit(url)
+    root = f"{parts.scheme}://{parts.netloc}"
+    if not get_robots(root).can_fetch(HEADERS["User-Agent"], url):
+        print(f"robots.txt disallows {url}")
+        return None
+    bucket = get_bucket(root, rate)
+
+    for attempt in range(retries + 1):
+        delay = backoff * 2 ** attempt
+        bucket.acquire()
+        try:
+            page = cached_get(url, timeout=timeout)
+        except (requests.Timeout, requests.ConnectionError) as error:
+            print(f"{url}: {error.__class__.__name__}, attempt {attempt + 1}")
+            time.sleep(delay)
+            continue
+
+        if page.status_code == 429 or page.status_code >= 500:
+            print(f"{url}: HTTP {page.status_code}, attempt {attempt + 1}")
+            # The server tells us how long to wait, this holds back all requests to the host
+            bucket.pause(retry_after_seconds(page) or delay)
+            continue
+
+        # Other errors (e.g. 404) are not retried, an error page must not be parsed as a listing or an article
+        if not (200 <= page.status_code < 300 or page.status_code == 304):
+            print(f"{url}: HTTP {page.status_code}")
+            return None
+
+        return page
+
+    print(f"Giving up on {url}")
+    return None
+
+
+def fetch_pages(urls, max_workers=4, rate=1.0, retries=3):
+    """ 
+    Fetches the URLs concurrently on a thread pool, at most 'rate' requests per second per host.
+    Yields (url, page) in the order of the URLs, page is None if the URL could not be fetched.
+    URLs are consumed lazily, so 'urls' can be a generator.
+    """
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for url in urls:
+            pending.append((url, executor.submit(fetch_page, url, rate, retries)))
+
+            # Bound the number of requests in flight
+            while len(pending) > 2 * max_workers:
+                url, future = pending.popleft()
+                yield url, future.result()
+
+        while pending:
+            url, future = pending.popleft()
+            yield url, future.result()
+
+
+def make_soup(page):
+    """ Parses the page, if page is already a soup object it is returned as it is"""
+
+    if isinstance(page, BeautifulSoup):
+        return page
+    return BeautifulSoup(page.content, HTML_PARSER)
+
+
+def parse_listing(page, last_href):
+    """ 
+    Parses a listing page once and returns the article titles, the article hrefs,
+    1 if last_href was reached (else 0) and the href of the next listing page.
+    """
+
+    soup = make_soup(page)
+    titles, hrefs, end = get_article_titles_and_hrefs(soup, last_href)
+    return titles, hrefs, end, get_next_page_href(soup)
+
+
+def parse_article(page):
+    """ 
+    Parses an article page once and returns a record with the article text, time/author,
+    headline, comment authors and comments.
+    """
+
+    soup = make_soup(page)
+    article_text, time_author = get_article(soup)
+    headline_text, comment_authors_texts, comments_texts = get_comments(soup)
+
+    return {
+        "text": article_text,
+        "time_author": time_author,
+        "headline": headline_text,
+        "comment_authors": comment_authors_texts,
+        "comments": comments_texts,
+    }
+
+
 def get_next_page_href(page):
-    """On a given webpage, finds and returns the URL for the 'next' page"""
+    """On a given webpage (or its soup), finds and returns the URL for the 'next' page"""
 
     # Convert page to soup object
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = make_soup(page)
 
     # Find the URL for the next page
     # Find the <img> tag with the specified src attribute
@@ -38,9 +333,9 @@ def get_next_page_href(page):
     return next_page_url
 
 def get_article_titles_and_hrefs(page, last_href):
-    """ For a given page, returns all article hrefs as a list"""
+    """ For a given page (or its soup), returns all article hrefs as a list"""
     # Convert to soup object
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = make_soup(page)
 
     # Locate all the links and store them in the list 'hrefs'
 
@@ -63,47 +358,75 @@ def get_article_titles_and_hrefs(page, last_href):
 
             article_hrefs.append(href)
 
-        # Get the title
-        article_title = span.get_text()
-        article_titles.append(article_title)
+            # Get the title, only for headlines with a link so the lists stay aligned
+            article_title = span.get_text()
+            article_titles.append(article_title)
 
     return article_titles, article_hrefs, 0
 
 
 
-def get_new_titles_and_hrefs(url, last_href):
-    # Create empty lists for titles and hrefs:
-    article_titles = []
-    article_hrefs = []
+def iter_new_titles_and_hrefs(url, last_href, prefetch=True, rate=1.0):
+    """ 
+    Streaming listing crawler: yields (title, href) of the articles newer than last_href, page by page.
+    Every listing page is fetched exactly once. With prefetch=True the next listing page is
+    loaded in the background while the articles of the current one are processed.
+    The listing pages are fetched with fetch_page, so they share the rate limit of the host with the articles.
+    Raises RuntimeError if a listing page can't be fetched, the crawl can't continue without it.
+    """
 
-    # Load home page
-    page = load_page(url)
+    def load_listing(listing_url):
+        page = fetch_page(listing_url, rate)
+        if page is None:
+            raise RuntimeError(f"Could not fetch the listing page {listing_url}")
+        return page
 
-    # Get next page URL
-    next_page_href = get_next_page_href(page)
+    # Links on the listing pages are relative to the site root
+    parts = urlsplit(url)
+    root = f"{parts.scheme}://{parts.netloc}"
 
-    # While next_page_URL:
-    while next_page_href:
-        
-        page = load_page(url)
+    # Articles can move to the next listing page while crawling, so they are only yielded once
+    seen = set()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Load home page
+        page = load_listing(url)
+
+        while True:
+            titles, hrefs, end, next_page_href = parse_listing(page, last_href)
+
+            # Stop after this page when the last available href or the last listing page is reached
+            next_url = root + next_page_href if end == 0 and next_page_href else None
+            if prefetch and next_url:
+                next_page = executor.submit(load_listing, next_url)
+
+            for title, href in zip(titles, hrefs):
+                if href not in seen:
+                    seen.add(href)
+                    yield title, href
+
+            if next_url is None:
+                break
+            page = next_page.result() if prefetch else load_listing(next_url)
 
-        titles, articles, end = get_article_titles_and_hrefs(page, last_href)
-        article_titles += titles
-        article_hrefs += articles
-        if end == 1:
-            break # Break out of the loop when the last available href is reached
-        
-        next_page_href = get_next_page_href(page)
-        url = "https://avherald.com" + next_page_href
+
+def get_new_titles_and_hrefs(url, last_href, rate=1.0):
+    """ Returns the titles and hrefs of all articles newer than last_href as 2 separate lists"""
+
+    article_titles = []
+    article_hrefs = []
+    for title, href in iter_new_titles_and_hrefs(url, last_href, rate=rate):
+        article_titles.append(title)
+        article_hrefs.append(href)
 
     return article_titles, article_hrefs # returns 2 separate lists
     
 
 
 def get_article(page):
-    """ For a given article page, returns the article text and the timestamp (including author)"""
+    """ For a given article page (or its soup), returns the article text and the timestamp (including author)"""
     # Convert to soup object
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = make_soup(page)
 
     # Locate all the links and store them in the list 'hrefs'
 
@@ -123,9 +446,9 @@ def get_article(page):
     return article_text, time_author
 
 def get_comments(page):
-    """ For a given article page, returns the title and the comments"""
-        # Convert to soup object
-    soup = BeautifulSoup(page.content, "html.parser")
+    """ For a given article page (or its soup), returns the title and the comments"""
+    # Convert to soup object
+    soup = make_soup(page)
 
     # Find the <span> element with the class 'headline_article', which is the article headline containing the event date
     headline = soup.find('span', {'class': 'headline_article'})
@@ -1,57 +1,261 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
 import fasttext
 from preprocessing_helpers import list_to_txt
 
 
+TFIDF_INDEX_DIR = "../models/tfidf_index"
+FILTER_COLUMNS = ("flight_phase", "occurrence", "from", "to")
+FASTTEXT_MODEL_PATH = "../models/fasttext_model.bin"
+FASTTEXT_EMBEDDINGS_PATH = "../models/fasttext_embeddings.npy"
+FASTTEXT_MANIFEST_PATH = "../models/fasttext_embeddings.json"
+
+# Loaded fasttext models, keyed by (path, modification time)
+_fasttext_models = {}
+
+
 def train_tfidf(df):
     """ Train the tfidf-model"""
 
     print("training tf-idf")
     print(len(df))
-    # Ensure all items in 'text' column are string
-    df['normalized_text'] = df['normalized_text'].apply(lambda x: str(x) if pd.notna(x) else '')
-
-    # Create the corpus to search for
-    norm_corpus = df.normalized_text.tolist()
+    # Create the corpus to search for, all items as strings.
+    # df is not modified, it can be the dataset shared by all sessions
+    norm_corpus = [str(x) if pd.notna(x) else '' for x in df['normalized_text']]
 
     # Tf-Idf vectorization
-    tv = TfidfVectorizer(min_df=0., max_df=1., norm='l2', use_idf=True)
-    tv_matrix = tv.fit_transform(norm_corpus)
-    tv_matrix = tv_matrix.toarray()
+    # The matrix is kept in sparse CSR format: a dense copy of it takes gigabytes for the full dataset
+    tv = TfidfVectorizer(min_df=0., max_df=1., norm='l2', use_idf=True, dtype=np.float32)
+    tv_matrix = tv.fit_transform(norm_corpus).tocsr()
 
     print("done training")
     return tv, tv_matrix
+
+
+def build_filter_bitmaps(df, columns=FILTER_COLUMNS):
+    """ 
+    For every filter column and value, precomputes the (sorted) row ids of the dataframe having that value.
+    Returns a dict {column: {value: row_ids}}
+    """
+
+    bitmaps = {}
+    for column in columns:
+        if column not in df.columns:
+            continue
+        codes, values = pd.factorize(df[column], sort=True)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+        bitmaps[column] = {value: order[bounds[i]:bounds[i + 1]].astype(np.int32) for i, value in enumerate(values)}
+
+    return bitmaps
+
+
+def filter_mask(bitmaps, filters, length):
+    """ 
+    Combines the selected filters {column: value} into a boolean row mask.
+    Filters with value None are ignored, None is returned if no filter is active.
+    """
+
+    mask = None
+    for column, value in filters.items():
+        if value is None:
+            continue
+        column_mask = np.zeros(length, dtype=bool)
+        column_mask[bitmaps[column].get(value, [])] = True
+        mask = column_mask if mask is None else mask & column_mask
+
+    return mask
+
+
+def top_k(scores, k, mask=None):
+    """ 
+    Partial top-k selection: returns the indices and scores of the k highest scores, in descending order.
+    Ties are broken by the lower index, so the result does not depend on the partition.
+    scores can be a 1-D vector or a 2-D matrix with one row per query (the indices and scores are then 2-D as well).
+    If a boolean mask is given (1-D, or 2-D with one row per query), only the positions where the mask is True are considered.
+    """
+
+    scores = np.asarray(scores)
+
+    if scores.ndim == 2:
+        indices = np.full((len(scores), min(k, scores.shape[1])), -1)
+        top_scores = np.full(indices.shape, -np.inf, dtype=np.float64)
+        for i, row in enumerate(scores):
+            row_mask = mask if mask is None or mask.ndim == 1 else mask[i]
+            row_indices, row_scores = top_k(row, k, row_mask)
+            indices[i, :len(row_indices)] = row_indices
+            top_scores[i, :len(row_indices)] = row_scores
+        return indices, top_scores
+
+    if mask is not None:
+        candidates = np.flatnonzero(mask)
+        indices, top_scores = top_k(scores[candidates], k)
+        return candidates[indices], top_scores
+
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=int), scores[:0]
+
+    # Partial selection of the k candidates, O(n) instead of sorting all scores
+    candidates = np.argpartition(-scores, k - 1)[:k]
+
+    # Everything above the k-th score is in the result, the ties at the k-th score are taken by index
+    kth_score = scores[candidates].min()
+    above = candidates[scores[candidates] > kth_score]
+    ties = np.flatnonzero(scores == kth_score)[:k - len(above)]
+    indices = np.concatenate([above, ties])
+
+    # Sort the k results by descending score, then ascending index
+    indices = indices[np.lexsort((indices, -scores[indices]))]
+    return indices, scores[indices]
     
 
-def tfidf_search(search_text, tv, tv_matrix, top_n=10):
+def tfidf_search(search_text, tv, tv_matrix, top_n=10, mask=None, with_scores=False):
     """ 
     The function takes a dataframe with the column 'normalized_text' and performs a tfidf-similarity search on it.
     It returns then the top_n similar occurrences from the dataset (optional, default is 10).
+    If a boolean row mask is given, only the rows where the mask is True are returned.
+    With with_scores=True, the similarity scores and the indices are returned like fasttext_search does.
     """
 
     # Transform the new text using the same vectorizer
-    search_text_vector = tv.transform([search_text]).toarray()
+    search_text_vector = tv.transform([search_text])
+
+    top_scores, top_indices = tfidf_vector_search(search_text_vector, tv_matrix, top_n, mask)
+
+    if with_scores:
+        return top_scores, top_indices
+    return top_indices
 
-    # Compute the cosine similarity between the new text and the corpus
-    similarity_scores = cosine_similarity(search_text_vector, tv_matrix).flatten()
-    print(len(similarity_scores))
+
+def tfidf_vector_search(search_text_vector, tv_matrix, top_n=10, mask=None):
+    """ tfidf-similarity search for an already transformed search text, returns the similarity scores and the indices of the top_n rows"""
+
+    # Rows of the tfidf-matrix and the search vector are L2-normalised,
+    # so the sparse dot product is the cosine similarity
+    similarity_scores = (tv_matrix @ search_text_vector.T).toarray().ravel()
 
     # Get the indices of the top n similarity scores
-    top_indices = similarity_scores.argsort()[-top_n:][::-1]
+    top_indices, top_scores = top_k(similarity_scores, top_n, mask)
 
-    return top_indices
+    return top_scores, top_indices
+
+
+
+
+def dataset_hash(df, columns=("href", "normalized_text")):
+    """ Returns a short hash identifying the content of the given dataframe columns"""
+
+    row_hashes = pd.util.hash_pandas_object(df[list(columns)].astype(str), index=False).values
+    return hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
+
+
+def write_json_atomic(obj, file_path):
+    """ Writes obj as JSON to a temporary file and renames it over file_path, readers never see a partial file"""
 
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(obj, file, indent=2)
+    os.replace(tmp_path, file_path)
+
+
+def save_tfidf_index(tv, tv_matrix, data_hash, index_dir=TFIDF_INDEX_DIR):
+    """ 
+    Saves the fitted vocabulary/idf and the sparse tfidf-matrix together with a manifest.
+    Every build goes to a new folder of index_dir and the manifest is switched to it at the end:
+    the arrays of the previous build may be memory-mapped by running searches and are never overwritten.
+    """
+
+    build = f"build_{data_hash}_{pd.Timestamp.now():%Y%m%dT%H%M%S_%f}"
+    build_dir = os.path.join(index_dir, build)
+    os.makedirs(build_dir)
+
+    # Vocabulary and idf-weights of the vectorizer
+    with open(os.path.join(build_dir, "vocabulary.json"), "w") as file:
+        json.dump({term: int(i) for term, i in tv.vocabulary_.items()}, file)
+    np.save(os.path.join(build_dir, "idf.npy"), tv.idf_)
+
+    # The CSR-arrays are stored as separate .npy files so that they can be memory-mapped
+    # (arrays inside a .npz archive can't)
+    for name in ("data", "indices", "indptr"):
+        np.save(os.path.join(build_dir, f"{name}.npy"), getattr(tv_matrix, name))
+
+    # The manifest is switched last, an index without manifest is considered incomplete
+    manifest = {
+        "dataset_hash": data_hash,
+        "build": build,
+        "shape": list(tv_matrix.shape),
+        "nnz": int(tv_matrix.nnz),
+        "created": pd.Timestamp.now().isoformat(),
+    }
+    write_json_atomic(manifest, os.path.join(index_dir, "manifest.json"))
+
+    # The previous build is kept for readers that read the manifest just before the switch, older ones are removed.
+    # Unlinking mapped files is safe, the mapping keeps the data until it is closed
+    builds = sorted((name for name in os.listdir(index_dir) if name.startswith("build_")), key=lambda name: name.rsplit("_", 2)[-2:])
+    for old_build in builds[:-2]:
+        shutil.rmtree(os.path.join(index_dir, old_build), ignore_errors=True)
+
+
+def read_index_manifest(index_dir=TFIDF_INDEX_DIR):
+    """ Returns the manifest of a saved index or None if there is no complete index"""
+
+    try:
+        with open(os.path.join(index_dir, "manifest.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
 
 
+def load_tfidf_index(index_dir=TFIDF_INDEX_DIR):
+    """ Loads a saved tfidf-index, the matrix arrays are memory-mapped from disk"""
+
+    manifest = read_index_manifest(index_dir)
+    # Indexes saved before the builds had their own folder are directly in index_dir
+    build_dir = os.path.join(index_dir, manifest.get("build", ""))
+
+    with open(os.path.join(build_dir, "vocabulary.json")) as file:
+        vocabulary = json.load(file)
+    tv = TfidfVectorizer(min_df=0., max_df=1., norm='l2', use_idf=True, dtype=np.float32, vocabulary=vocabulary)
+    tv.idf_ = np.load(os.path.join(build_dir, "idf.npy"))
+
+    data, indices, indptr = (np.load(os.path.join(build_dir, f"{name}.npy"), mmap_mode="r") for name in ("data", "indices", "indptr"))
+    tv_matrix = sparse.csr_matrix((data, indices, indptr), shape=tuple(manifest["shape"]), copy=False)
+
+    return tv, tv_matrix
+
+
+def get_tfidf_index(df, index_dir=TFIDF_INDEX_DIR):
+    """ 
+    Returns the tfidf-index for the dataframe.
+    The saved index is loaded if it was built on the same data, otherwise the index is rebuilt and saved.
+    """
+
+    data_hash = dataset_hash(df)
+    manifest = read_index_manifest(index_dir)
+
+    if manifest is not None and manifest["dataset_hash"] == data_hash:
+        print("loading tf-idf index")
+        return load_tfidf_index(index_dir)
+
+    tv, tv_matrix = train_tfidf(df)
+    save_tfidf_index(tv, tv_matrix, data_hash, index_dir)
+    return tv, tv_matrix
+
 
 def train_fasttext(df, txt_filepath, model='skipgram'):
-    """ Train the fasttext model"""
+    """ Train the fasttext model and precompute the sentence embeddings of the corpus"""
    
     # Create the text corpus
     print("Creating text corpus...")
@@ -65,45 +269,130 @@ def train_fasttext(df, txt_filepath, model='skipgram'):
         print("An error occurred during training of the model.")
         return 0
 
-    # Save the model
+    # Save the model, replaced in one step so a loading session never reads a partial file
     try:
-        model_path = "../models/fasttext_model.bin"
-        model.save_model(model_path)
+        tmp_path = f"{FASTTEXT_MODEL_PATH}.{os.getpid()}.tmp"
+        model.save_model(tmp_path)
+        os.replace(tmp_path, FASTTEXT_MODEL_PATH)
     except:
         print("An error occurred during saving of the model.")
         return 0
 
+    # Save the embeddings of the corpus next to the model, with the hash of the rows they belong to
+    try:
+        save_fasttext_embeddings(embed_fasttext_texts(model, texts), fasttext_dataset_hash(df))
+    except:
+        print("An error occurred during saving of the embeddings.")
+        return 0
+
     print("Fasttext model training complete.")
     return 1
 
 
-def fasttext_search(search_text, model_path, txt_filepath, top_n):
+def embed_fasttext_texts(model, texts):
+    """ Embeds the texts like the lines of the training corpus (see list_to_txt), returns the L2-normalised float32 matrix"""
+
+    embeddings = np.array(
+        [model.get_sentence_vector(re.sub(r'[\n\r\t\s]+', ' ', str(text), flags=re.UNICODE).strip()) for text in texts],
+        dtype=np.float32,
+    ).reshape(len(texts), model.get_dimension())
+
+    # Normalise the rows, the cosine similarity is then a plain dot product
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+
+def save_fasttext_embeddings(embeddings, data_hash, embeddings_path=FASTTEXT_EMBEDDINGS_PATH, manifest_path=FASTTEXT_MANIFEST_PATH):
     """ 
-    The function takes a dataframe with the column 'normalized_text' and performs a fasttext-similarity search on it.
-    It returns then the top_n similar occurrences from the dataset (optional, default is 10).
+    Saves the embeddings and then their manifest. The embeddings are written to a temporary file that replaces
+    the old one: running searches may have the old file memory-mapped, it must not be overwritten in place.
     """
 
-    # Load the trained model
-    model = fasttext.load_model(model_path)
+    tmp_path = f"{embeddings_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        np.save(file, embeddings)
+    os.replace(tmp_path, embeddings_path)
+    save_fasttext_manifest(data_hash, manifest_path)
+    print(f"Saved {len(embeddings)} embeddings to {embeddings_path}")
 
-    # Read the corpus and generate embeddings
-    corpus_file = txt_filepath
-    embeddings = []
-    texts = []
 
-    with open(corpus_file, 'r') as f:
-        for line in f:
-            text = line.strip()
-            texts.append(text)
-            embeddings.append(model.get_sentence_vector(text))
+def load_fasttext_model(model_path=FASTTEXT_MODEL_PATH):
+    """ Loads the fasttext model once per process, it is reloaded only if the model file changed"""
 
-    # Convert to numpy array for easier manipulation
-    embeddings = np.array(embeddings)
+    key = (model_path, os.path.getmtime(model_path))
+    if key not in _fasttext_models:
+        _fasttext_models.clear()
+        _fasttext_models[key] = fasttext.load_model(model_path)
 
-    # Find similar texts to the search_text
-    new_embedding = model.get_sentence_vector(search_text)
-    similarities = cosine_similarity([new_embedding], embeddings)[0]
-    similar_indices = similarities.argsort()[-top_n:][::-1]
-    
-    return [(texts[i], similarities[i]) for i in similar_indices], similar_indices
+    return _fasttext_models[key]
+
+
+def fasttext_dataset_hash(df):
+    """ Hash of the rows the FastText embeddings are built from, in their order"""
+
+    return dataset_hash(df, columns=("href", "text"))
+
+
+def save_fasttext_manifest(data_hash, manifest_path=FASTTEXT_MANIFEST_PATH):
+    """ Saves the manifest of the FastText embeddings, it is written after the embeddings"""
+
+    manifest = {"dataset_hash": data_hash, "created": pd.Timestamp.now().isoformat()}
+    write_json_atomic(manifest, manifest_path)
+
+
+def read_fasttext_manifest(manifest_path=FASTTEXT_MANIFEST_PATH):
+    """ Returns the manifest of the FastText embeddings or None"""
+
+    try:
+        with open(manifest_path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def load_fasttext_embeddings(embeddings_path=FASTTEXT_EMBEDDINGS_PATH):
+    """ Memory-maps the precomputed sentence embeddings of the corpus"""
+
+    return np.load(embeddings_path, mmap_mode="r")
+
+
+def dense_search(query_vector, embeddings, top_n, mask=None, index=None):
+    """ 
+    Searches the L2-normalised embedding matrix for the rows most similar to the query vector.
+    Uses the approximate nearest neighbour index if one is given (see ann_index.py), otherwise an exact matrix-vector product.
+    Returns the similarity scores and the indices of the top_n rows.
+    """
+
+    norm = np.linalg.norm(query_vector)
+    if norm > 0:
+        query_vector = query_vector / norm
+
+    if index is not None:
+        return index.search(query_vector, top_n, mask)
+
+    # The corpus embeddings are L2-normalised, so one matrix-vector product gives the cosine similarities
+    similarities = embeddings @ query_vector
+    similar_indices, scores = top_k(similarities, top_n, mask)
+
+    return scores, similar_indices
+
+
+def fasttext_search(search_text, model, embeddings, top_n, mask=None, index=None):
+    """ 
+    The function takes the fasttext model and the precomputed embeddings of the corpus and performs a fasttext-similarity search.
+    It returns the similarity scores and the indices of the top_n similar occurrences from the dataset.
+    If a boolean row mask is given, only the rows where the mask is True are returned.
+    """
+
+    new_embedding = fasttext_query_vector(model, search_text)
+
+    return dense_search(new_embedding, embeddings, top_n, mask, index)
+
+
+def fasttext_query_vector(model, search_text):
+    """ Embeds the search text with the fasttext model"""
 
+    # get_sentence_vector does not accept line breaks
+    search_text = re.sub(r'[\n\r\t\s]+', ' ', search_text, flags=re.UNICODE)
+    return model.get_sentence_vector(search_text)
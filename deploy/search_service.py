@@ -0,0 +1,240 @@
+"""
+Headless HTTP/JSON search service over the shared indexes of the app (see shared_resources.py), stdlib only.
+    GET  /search?engine=tfidf|fasttext|st&q=...&top_n=10&flight_phase=...&occurrence=...
+    POST /search with {"engine": "tfidf", "queries": ["...", "..."], "top_n": 10, "filters": {"flight_phase": "..."}}
+    GET  /health
+    GET  /stats   hit rates of the query cache (see query_cache.py)
+The indexes are loaded once and stay in memory, every response reports its timings.
+Run from the deploy folder: python search_service.py --port 8765 --warm tfidf
+The Streamlit pages become thin clients of the service if SEARCH_SERVICE_URL is set, e.g. http://127.0.0.1:8765
+"""
+
+
+import argparse
+import json
+import os
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from shared_resources import *
+from query_cache import *
+
+
+SEARCH_ENGINES = ("tfidf", "fasttext", "st")
+SEARCH_SERVICE_URL = os.environ.get("SEARCH_SERVICE_URL")
+
+# Number of characters of the article text returned with every hit
+SNIPPET_CHARS = 800
+
+
+def article_hits(df, scores, indices):
+    """ The articles found by a search as a list of dicts, in the order of the results"""
+
+    hits = []
+    for score, row in zip(scores, indices):
+        article = df.iloc[row]
+        hits.append({
+            "row": int(row),
+            "score": float(score),
+            "title": article.title,
+            "href": article.href,
+            "url": article.url,
+            "text": article.text[:SNIPPET_CHARS],
+        })
+
+    return hits
+
+
+def search_queries(engine, queries, top_n=10, filters=None, path=DATASET_PATH):
+    """
+    Runs the queries on one engine with the shared indexes.
+    Returns the dataset version, the hits of every query and the timings in milliseconds.
+    Raises ValueError for an unknown engine or an engine without a model for the current dataset.
+    """
+
+    if engine not in SEARCH_ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', use one of {', '.join(SEARCH_ENGINES)}")
+    unknown_filters = set(filters or {}) - set(FILTER_COLUMNS)
+    if unknown_filters:
+        raise ValueError(f"Unknown filters {sorted(unknown_filters)}, use {', '.join(FILTER_COLUMNS)}")
+    invalid_filters = sorted(column for column, value in (filters or {}).items() if value is not None and not isinstance(value, str))
+    if invalid_filters:
+        raise ValueError(f"The values of the filters {invalid_filters} must be strings")
+
+    start = time.perf_counter()
+    version = current_version(path)
+    df = shared_dataset(version, path)
+    mask = filter_mask(shared_filter_bitmaps(version, path), filters or {}, len(df))
+
+    # Indexes and models, only loaded by the first request after a change of the dataset
+    if engine == "tfidf":
+        tv, tv_matrix = shared_tfidf_index(version, path)
+        encode = tv.transform
+    elif engine == "fasttext":
+        embeddings = shared_fasttext_embeddings(version, path)
+        if embeddings is None:
+            raise ValueError("No FastText model is trained for the current dataset")
+        model = load_fasttext_model()
+        index = shared_fasttext_ann_index(version, path)
+        encode = lambda texts: [fasttext_query_vector(model, text) for text in texts]
+    else:
+        model = load_sentence_transformer(ST_MODEL_NAME)
+        embeddings = shared_st_embeddings(version, path)
+        index = shared_st_ann_index(version, path)
+        # The queries of a batch are encoded together
+        encode = lambda texts: model.encode(list(texts), normalize_embeddings=True)
+    loaded = time.perf_counter()
+
+    # Repeated queries are answered from the result cache, the others only encode the queries without a cached vector
+    check_version(version)
+    generation = index_generation(engine)
+    keys = [result_key(engine, query, top_n, mask, version, generation) for query in queries]
+    results = [get_result(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    vectors = query_vectors(engine, [queries[i] for i in missing], encode, generation)
+    for i, vector in zip(missing, vectors):
+        if engine == "tfidf":
+            results[i] = tfidf_vector_search(vector, tv_matrix, top_n, mask)
+        else:
+            results[i] = dense_search(vector, embeddings, top_n, mask, index)
+        put_result(keys[i], results[i])
+    searched = time.perf_counter()
+
+    hits = [article_hits(df, scores, indices) for scores, indices in results]
+    timings = {
+        "load_ms": (loaded - start) * 1000,
+        "search_ms": (searched - loaded) * 1000,
+        "total_ms": (time.perf_counter() - start) * 1000,
+    }
+
+    return version, hits, timings
+
+
+def make_handler(path=DATASET_PATH):
+    """ Request handler of the search service for the dataset at path"""
+
+    class SearchHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def search(self, engine, queries, top_n, filters):
+            start = time.perf_counter()
+            try:
+                version, hits, timings = search_queries(engine, queries, int(top_n), filters, path)
+            except ValueError as error:
+                self.send_json(400, {"error": str(error)})
+                return
+            except Exception as error:
+                # e.g. sentence-transformers not installed, the client still gets an answer
+                traceback.print_exc()
+                self.send_json(500, {"error": repr(error)})
+                return
+
+            timings["request_ms"] = (time.perf_counter() - start) * 1000
+            self.send_json(200, {
+                "engine": engine,
+                "version": version,
+                "results": [{"query": query, "hits": query_hits} for query, query_hits in zip(queries, hits)],
+                "timings": timings,
+            })
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+            if url.path == "/health":
+                self.send_json(200, {"status": "ok", "version": dataset_version(path)})
+            elif url.path == "/stats":
+                self.send_json(200, get_query_cache_stats())
+            elif url.path == "/search":
+                filters = {column: params.get(column) for column in FILTER_COLUMNS}
+                self.search(params.get("engine", "tfidf"), [params.get("q", "")], params.get("top_n", 10), filters)
+            else:
+                self.send_json(404, {"error": f"Unknown path {url.path}"})
+
+        def do_POST(self):
+            if urlsplit(self.path).path != "/search":
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                queries = [str(query) for query in body["queries"]] if isinstance(body["queries"], list) else None
+            except (ValueError, KeyError, TypeError):
+                queries = None
+            if queries is None:
+                self.send_json(400, {"error": "Expected a JSON body with a list of 'queries'"})
+                return
+            if not isinstance(body.get("filters") or {}, dict):
+                self.send_json(400, {"error": "Expected 'filters' as an object of column: value"})
+                return
+
+            self.search(body.get("engine", "tfidf"), queries, body.get("top_n", 10), body.get("filters"))
+
+    return SearchHandler
+
+
+def remote_search(engine, queries, top_n=10, filters=None, url=SEARCH_SERVICE_URL, timeout=60):
+    """
+    Client of the search service: returns the hits of every query.
+    Raises ValueError with the message of the service if it rejects the search (e.g. no FastText model is trained),
+    requests.HTTPError on other errors.
+    """
+
+    response = requests.post(
+        url.rstrip("/") + "/search",
+        json={"engine": engine, "queries": list(queries), "top_n": top_n, "filters": filters or {}},
+        timeout=timeout,
+    )
+    if response.status_code == 400:
+        raise ValueError(response.json()["error"])
+    response.raise_for_status()
+    return [result["hits"] for result in response.json()["results"]]
+
+
+def page_search(engine, search_text, top_n=10, filters=None):
+    """
+    Search of one text for the Streamlit pages: on the search service if SEARCH_SERVICE_URL is set, otherwise
+    with the shared indexes. Returns the hits and an error message for the page (None if the search succeeded).
+    """
+
+    try:
+        if SEARCH_SERVICE_URL:
+            return remote_search(engine, [search_text], top_n, filters)[0], None
+        return search_queries(engine, [search_text], top_n, filters)[1][0], None
+    except ValueError as error:
+        return [], str(error)
+    except ImportError:
+        return [], "sentence-transformers is not installed."
+    except requests.RequestException as error:
+        return [], f"The search service failed: {error}"
+
+
+def serve_search(port=8765, path=DATASET_PATH, warm=()):
+    """ Serves the search API until interrupted, the indexes of the 'warm' engines are loaded before the first request"""
+
+    for engine in warm:
+        search_queries(engine, ["warm up"], 1, path=path)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(path))
+    print(f"Search service on http://127.0.0.1:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/JSON search service for the Aviation Herald dataset")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", default=DATASET_PATH, help="Path of the processed dataset")
+    parser.add_argument("--warm", nargs="*", default=["tfidf"], choices=SEARCH_ENGINES, help="Engines whose indexes are loaded at startup")
+    args = parser.parse_args()
+
+    serve_search(args.port, args.path, args.warm)
@@ -0,0 +1,63 @@
+"""
+Local stand-in for avherald.com, serving saved Aviation Herald pages.
+Save pages with save_fixture, then run: python serve_fixtures.py ../data/fixtures --port 8000
+and point the updater at it: update(path, base_url="http://127.0.0.1:8000")
+"""
+
+
+import argparse
+import os
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+
+def fixture_name(path):
+    """ File name of a saved page, for a path like '/h?article=51b7f1a6&opt=0'"""
+
+    return quote(path, safe="") + ".html"
+
+
+def save_fixture(url_path, page, fixture_dir):
+    """ Saves the response for url_path (path and query of the URL) to the fixture folder"""
+
+    os.makedirs(fixture_dir, exist_ok=True)
+    with open(os.path.join(fixture_dir, fixture_name(url_path)), "wb") as file:
+        file.write(page.content)
+
+
+def make_handler(fixture_dir):
+    """ Request handler serving the saved pages of fixture_dir, unknown paths return 404"""
+
+    class FixtureHandler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            file_path = os.path.join(fixture_dir, fixture_name(self.path))
+            if self.path == "/robots.txt" or not os.path.exists(file_path):
+                self.send_error(404)
+                return
+
+            with open(file_path, "rb") as file:
+                content = file.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return FixtureHandler
+
+
+def serve_fixtures(fixture_dir, port=8000):
+    """ Serves the saved pages until interrupted"""
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fixture_dir))
+    print(f"Serving {fixture_dir} on http://127.0.0.1:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve saved Aviation Herald pages")
+    parser.add_argument("fixture_dir")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    serve_fixtures(args.fixture_dir, args.port)
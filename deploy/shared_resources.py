@@ -0,0 +1,171 @@
+"""
+Read-only resources of the Streamlit app shared by all sessions: the dataset, the filter row ids and the
+search indexes are loaded once per server process instead of once per session.
+Every resource is stored with the dataset version it was built for and is rebuilt on first use after the
+version has changed (see dataset_store.dataset_version), so an update swaps in the new data for all sessions.
+The resources must not be modified by the pages.
+"""
+
+
+import itertools
+import os
+import threading
+
+import pandas as pd
+
+from dataset_store import *
+from search_models import *
+from embedding_store import *
+from ann_index import *
+
+
+# name -> (dataset version, resource, generation)
+RESOURCES = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+# Every build of a resource gets a new generation number, caches of results computed with a resource key on it
+_generations = itertools.count(1)
+
+# The resources behind the query vectors and the results of every search engine
+ENGINE_RESOURCES = {
+    "tfidf": ("tfidf_index",),
+    "fasttext": ("fasttext_embeddings", "fasttext_ann_index"),
+    "st": ("st_embeddings", "st_ann_index"),
+}
+
+
+def _lock(name):
+    with _registry_lock:
+        return _locks.setdefault(name, threading.Lock())
+
+
+def current_version(path=DATASET_PATH):
+    """ Version of the dataset, the old dataset format is migrated first if needed"""
+
+    if read_manifest(path) is None:
+        migrate_to_segments(path)
+    return dataset_version(path)
+
+
+def get_resource(name, version, loader):
+    """
+    Returns the shared resource 'name' built for the dataset version, loader() is called to build it
+    if it was built for another version or not at all. Concurrent sessions wait for a single build.
+    """
+
+    with _lock(name):
+        entry = RESOURCES.get(name)
+        if entry is None or entry[0] != version:
+            # Drop the old resource before building the new one, so they are not both in memory
+            RESOURCES.pop(name, None)
+            print(f"Loading shared resource '{name}' for dataset version {version}")
+            RESOURCES[name] = (version, loader(), next(_generations))
+
+        return RESOURCES[name][1]
+
+
+def has_resource(name):
+    """ True if the resource was built, for any dataset version"""
+
+    return name in RESOURCES
+
+
+def resource_generation(name):
+    """ Generation of the loaded resource 'name' (None if it is not loaded), it changes with every rebuild"""
+
+    entry = RESOURCES.get(name)
+    return entry[2] if entry is not None else None
+
+
+def index_generation(engine):
+    """ Generations of the resources that the results of a search engine ('tfidf', 'fasttext' or 'st') depend on"""
+
+    return tuple(resource_generation(name) for name in ENGINE_RESOURCES[engine])
+
+
+def invalidate(name):
+    """ Drops a resource, e.g. after retraining a model, it is rebuilt on its next use"""
+
+    with _lock(name):
+        RESOURCES.pop(name, None)
+
+
+def shared_dataset(version, path=DATASET_PATH):
+    """ The full dataset"""
+
+    return get_resource("dataset", version, lambda: load_dataset(path))
+
+
+def shared_home_dataset(version, path=DATASET_PATH):
+    """ Only the columns of the dataset shown on the Home page, so opening Home does not load the full dataset"""
+
+    return get_resource("home_dataset", version, lambda: load_dataset(path, columns=HOME_COLUMNS))
+
+
+def shared_filter_bitmaps(version, path=DATASET_PATH):
+    """ Row ids of the filter values of the full dataset"""
+
+    return get_resource("filter_bitmaps", version, lambda: build_filter_bitmaps(shared_dataset(version, path)))
+
+
+def shared_tfidf_index(version, path=DATASET_PATH):
+    """ The TF-IDF vectorizer and matrix of the full dataset, loaded from the saved index if it matches"""
+
+    return get_resource("tfidf_index", version, lambda: get_tfidf_index(shared_dataset(version, path)))
+
+
+def shared_fasttext_embeddings(version, path=DATASET_PATH):
+    """
+    The FastText embeddings of the full dataset, None if no model is trained yet.
+    The saved embeddings are only used if their manifest has the hash of the dataset rows, a dataset of the
+    same length but with other or reordered rows would pair the rows with the wrong vectors.
+    After an update of the dataset, the rows are embedded again with the trained model (without retraining it).
+    """
+
+    def load():
+        if not os.path.exists(FASTTEXT_MODEL_PATH):
+            return None
+
+        df = shared_dataset(version, path)
+        data_hash = fasttext_dataset_hash(df)
+        manifest = read_fasttext_manifest()
+        if manifest is not None and manifest["dataset_hash"] == data_hash and os.path.exists(FASTTEXT_EMBEDDINGS_PATH):
+            embeddings = load_fasttext_embeddings()
+            if len(embeddings) == len(df):
+                return embeddings
+
+        print("FastText embeddings do not match the dataset, embedding it with the trained model")
+        save_fasttext_embeddings(embed_fasttext_texts(load_fasttext_model(), df.text.tolist()), data_hash)
+        return load_fasttext_embeddings()
+
+    return get_resource("fasttext_embeddings", version, load)
+
+
+def shared_fasttext_ann_index(version, path=DATASET_PATH):
+    """ ANN index over the FastText embeddings, None for small corpora (the exact search is used then)"""
+
+    return get_resource("fasttext_ann_index", version, lambda: build_ann_index(shared_fasttext_embeddings(version, path)))
+
+
+def shared_st_embeddings(version, path=DATASET_PATH):
+    """ The SentenceTransformer embeddings of the full dataset, articles missing from the store are embedded first"""
+
+    def load():
+        df = shared_dataset(version, path)
+        update_embedding_store(df, load_sentence_transformer(ST_MODEL_NAME))
+        return get_embeddings(df)
+
+    return get_resource("st_embeddings", version, load)
+
+
+def shared_st_ann_index(version, path=DATASET_PATH):
+    """ ANN index over the SentenceTransformer embeddings, None for small corpora"""
+
+    return get_resource("st_ann_index", version, lambda: build_ann_index(shared_st_embeddings(version, path)))
+
+
+def shared_aircraft_list(path="aircraft_list.tsv"):
+    """ The aircraft list shown on the Home page, it does not depend on the dataset version"""
+
+    return get_resource("aircraft_list", None, lambda: pd.read_csv(path, sep='\t'))
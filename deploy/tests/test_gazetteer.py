@@ -0,0 +1,69 @@
+"""
+Equivalence of the Gazetteer automaton with the substring loop of get_from_to_airport.
+Run from the deploy folder: python -m pytest tests
+"""
+
+
+import random
+
+import pytest
+
+from preprocessing_helpers import Gazetteer, get_from_to_airport
+
+
+# Overlapping names, names contained in other names and names sharing prefixes, in a deliberate list order
+CITY_NAMES = ["York", "New York", "Newark", "Ark", "Paris", "Par", "Aris", "Bristol", "Bristol Bay", "To", "Toronto", "Oslo"]
+
+TEXTS = [
+    "A B738 was enroute from New York to Paris (France) when",
+    "A A320 was enroute from Newark to New York when",
+    "A DH8D from Bristol Bay to Toronto)",
+    "A B744 from Oslo to Arkansas",
+    "A A321 from Parma to Arista",
+    "A B763 from Paris",                   # no "to"
+    "An A333 at Paris to be continued",    # no "from"
+    "A B77W from Boston to Oslo",         # "to" inside a city name
+    "A A359 from nowhere to nowhere",      # no city at all
+    "",
+    "A E190 from " + "x" * 300 + " to Oslo",  # "to" beyond the first 300 characters
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_from_to_equals_substring_loop(text):
+    gazetteer = Gazetteer(CITY_NAMES)
+
+    assert gazetteer.from_to(text) == get_from_to_airport(text, CITY_NAMES)
+
+
+@pytest.mark.parametrize("names", [CITY_NAMES, CITY_NAMES[::-1], sorted(CITY_NAMES, key=len)])
+def test_list_order_decides_between_matches(names):
+    gazetteer = Gazetteer(names)
+
+    for text in TEXTS:
+        assert gazetteer.from_to(text) == get_from_to_airport(text, names)
+
+
+def test_empty_name_matches_every_text():
+    names = ["Oslo", "", "Paris"]
+    gazetteer = Gazetteer(names)
+
+    for text in TEXTS:
+        assert gazetteer.from_to(text) == get_from_to_airport(text, names)
+
+
+def test_random_texts():
+    rng = random.Random(0)
+    words = CITY_NAMES + ["from", "to", "the", "flight", "Ne", "wYork", "(", ")", "rk"]
+    gazetteer = Gazetteer(CITY_NAMES)
+
+    for _ in range(2000):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(0, 12)))
+        assert gazetteer.from_to(text) == get_from_to_airport(text, CITY_NAMES), text
+
+
+def test_from_to_codes_take_the_code_of_the_first_name():
+    gazetteer = Gazetteer(["Paris", "London", "Paris"], ["PHT", "YXU", "CDG"])
+
+    # Several airports share a city name, the code of the first one in the list is returned
+    assert gazetteer.from_to_codes("A A320 from Paris to London") == ("PHT", "YXU")
@@ -0,0 +1,46 @@
+"""
+The article records must not depend on the HTML parser: lxml is used if it is installed, html.parser otherwise.
+Run from the deploy folder: python -m pytest tests
+"""
+
+
+import pytest
+from bs4 import BeautifulSoup
+
+from scraping_helpers import parse_article
+
+
+pytest.importorskip("lxml")
+
+
+class SavedPage:
+    """ Stand-in for a requests response"""
+
+    def __init__(self, content):
+        self.content = content.encode("utf-8")
+
+
+# Markup like the article pages of the site: table layout, unclosed <p> and <font>, <br> without slash, entities
+ARTICLE_PAGE = """<html><head><title>Incident</title></head><body>
+<table><tr><td><span class="headline_article">Incident: Delta A321 at Atlanta on Jan 1st 2024, engine fire</span>
+<tr><td><span class="time_avherald">By Simon Hradecky, created Monday, Jan 1st 2024 10:00Z</span>
+<td><span class="sitetext">Share</span><span class="sitetext">Print</span><span class="sitetext">Report</span>
+<span class="sitetext"><p>A Delta A321 was climbing out of Atlanta,GA (USA) when the crew
+reported an engine fire.<br>The aircraft returned &amp; landed safely.<p><font size=2>The FAA reported
+</span></table>
+<table><tr><td><span class="time_avherald">By Reader on Monday, Jan 1st 2024 12:00Z</span>
+<span class="sitecomment">Glad everyone is safe.<br>Good job &lt;crew&gt;</span>
+<tr><td><span class="time_avherald">By Other on Monday, Jan 1st 2024 13:00Z</span>
+<span class="sitecomment">Which engine?</span></table>
+</body></html>"""
+
+
+@pytest.mark.parametrize("content", [ARTICLE_PAGE, ARTICLE_PAGE.replace("</table>", ""), ARTICLE_PAGE.replace("</span>", "", 1)])
+def test_lxml_and_html_parser_give_the_same_record(content):
+    page = SavedPage(content)
+
+    record = parse_article(BeautifulSoup(page.content, "lxml"))
+
+    assert record == parse_article(BeautifulSoup(page.content, "html.parser"))
+    assert record["headline"].startswith("Incident: Delta A321")
+    assert "engine fire" in record["text"]
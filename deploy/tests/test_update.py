@@ -0,0 +1,124 @@
+"""
+The fetcher and the update against the serve_fixtures stand-in of the site, with missing (404) and failing (503) pages.
+Run from the deploy folder: python -m pytest tests
+"""
+
+
+import threading
+from http.server import ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import scraping_helpers
+import update_dataset
+from dataset_store import load_dataset, read_manifest, write_dataset
+from serve_fixtures import make_handler, save_fixture
+
+
+OLD_HREF = "/h?article=old"
+
+
+class SavedPage:
+    """ Stand-in for a requests response"""
+
+    def __init__(self, content):
+        self.content = content.encode("utf-8")
+
+
+def listing_page(hrefs, next_href=None):
+    links = "".join(f'<a href="{href}"><span class="headline_avherald">Incident: Title {href}</span></a><br>' for href in hrefs)
+    if next_href:
+        links += f'<a href="{next_href}"><img src="/images/next.jpg"></a>'
+    return SavedPage(f"<html><body>{links}</body></html>")
+
+
+def article_page(href):
+    return SavedPage(
+        '<html><body><span class="headline_article">Incident: A320 at Somewhere</span>'
+        '<span class="time_avherald">By Simon Hradecky, created Monday, Jan 1st 2024 10:00Z</span>'
+        + '<span class="sitetext"></span>' * 3
+        + f'<span class="sitetext">Text of {href}</span></body></html>'
+    )
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """ Serves the pages saved to tmp_path/fixtures, the paths in site.unavailable answer 503"""
+
+    fixture_dir = tmp_path / "fixtures"
+    unavailable = set()
+
+    class Handler(make_handler(str(fixture_dir))):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path in unavailable:
+                self.send_error(503)
+                return
+            super().do_GET()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Fast retries, no rate limit worth waiting for and no lexicons for the preprocessing
+    monkeypatch.setattr(scraping_helpers.fetch_page, "__defaults__", (100.0, 2, 0.01, 5))
+    monkeypatch.setattr(update_dataset, "preprocess_articles", lambda df: df)
+
+    site = type("Site", (), {})()
+    site.url = f"http://127.0.0.1:{server.server_port}"
+    site.fixture_dir = str(fixture_dir)
+    site.unavailable = unavailable
+    site.dataset = str(tmp_path / "dataset")
+    site.checkpoint = str(tmp_path / "checkpoint.sqlite")
+    write_dataset(pd.DataFrame({"title": ["Old"], "href": [OLD_HREF], "text": ["Old text"]}), site.dataset)
+    yield site
+    server.shutdown()
+
+
+def run_update(site):
+    return update_dataset.update(site.dataset, embed=False, base_url=site.url, rate=100.0, checkpoint_path=site.checkpoint)
+
+
+def test_fetch_page_returns_none_for_error_pages(site):
+    save_fixture("/h?article=1", article_page("/h?article=1"), site.fixture_dir)
+    site.unavailable.add("/h?article=2")
+
+    assert scraping_helpers.fetch_page(site.url + "/h?article=1").status_code == 200
+    assert scraping_helpers.fetch_page(site.url + "/h?article=404") is None
+    assert scraping_helpers.fetch_page(site.url + "/h?article=2") is None
+
+
+def test_missing_listing_page_stops_the_update(site):
+    # The second listing page is missing, the articles on it can't be skipped
+    save_fixture("/", listing_page(["/h?article=1"], next_href="/?page=2"), site.fixture_dir)
+    save_fixture("/h?article=1", article_page("/h?article=1"), site.fixture_dir)
+
+    with pytest.raises(RuntimeError):
+        run_update(site)
+
+    assert read_manifest(site.dataset)["newest_href"] == OLD_HREF
+    assert list(load_dataset(site.dataset).href) == [OLD_HREF]
+
+
+def test_missing_and_failing_articles_are_retried_by_the_next_update(site):
+    hrefs = [f"/h?article={i}" for i in range(4)]
+    save_fixture("/", listing_page(hrefs + [OLD_HREF]), site.fixture_dir)
+    for href in hrefs[:2]:
+        save_fixture(href, article_page(href), site.fixture_dir)
+    site.unavailable.add(hrefs[3])  # hrefs[2] is missing (404)
+
+    df = run_update(site)
+    assert list(df.href) == hrefs[:2]
+    assert df.attrs["failed_hrefs"] == hrefs[2:]
+
+    # Once the pages are back, the next update fetches them although newest_href moved past them
+    save_fixture(hrefs[2], article_page(hrefs[2]), site.fixture_dir)
+    save_fixture(hrefs[3], article_page(hrefs[3]), site.fixture_dir)
+    site.unavailable.clear()
+
+    df = run_update(site)
+    assert list(df.href) == hrefs[2:]
+    assert df.attrs["failed_hrefs"] == []
+    assert sorted(load_dataset(site.dataset).href) == sorted(hrefs + [OLD_HREF])
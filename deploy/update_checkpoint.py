@@ -0,0 +1,143 @@
+"""
+Durable checkpoint of a running dataset update.
+The hrefs found on the listing pages are queued in a SQLite database and every article is stored
+there as soon as it is fetched and parsed, so a restarted update resumes where it stopped without
+refetching. The checkpoint belongs to the newest article of the dataset when the update started
+and is removed once the new articles are appended to the dataset. Articles that could not be fetched
+are carried over to the next update instead.
+"""
+
+
+import json
+import os
+import sqlite3
+import threading
+
+
+CHECKPOINT_PATH = "../data/interim/update_checkpoint.sqlite"
+
+
+def pid_alive(pid):
+    """ True if a process with this pid is running"""
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class UpdateCheckpoint:
+    """ Work queue of the article hrefs of one update plus the fetched articles"""
+
+    def __init__(self, last_href, path=CHECKPOINT_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS queue ("
+                "href TEXT PRIMARY KEY, title TEXT, url TEXT, position INTEGER, "
+                "status TEXT NOT NULL DEFAULT 'pending', record TEXT)"
+            )
+
+        # A checkpoint of an older dataset state is stale: its articles are either appended already or outdated
+        if self.get_meta("last_href", last_href) != last_href:
+            print("Discarding the checkpoint of an older dataset state")
+            with self.connection:
+                self.connection.execute("DELETE FROM meta")
+                self.connection.execute("DELETE FROM queue")
+        self.set_meta("last_href", last_href)
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def acquire(self):
+        """ Marks the checkpoint as owned by this process, raises RuntimeError if another update is running"""
+
+        pid = self.get_meta("pid")
+        if pid is not None and pid != os.getpid() and pid_alive(pid):
+            raise RuntimeError(f"Another update is running (pid {pid})")
+        self.set_meta("pid", os.getpid())
+
+    def listing_complete(self):
+        """ True if all new hrefs of the listing pages are queued"""
+
+        return self.get_meta("listing_complete", False)
+
+    def mark_listing_complete(self):
+        self.set_meta("listing_complete", True)
+
+    def enqueue(self, position, title, href, url):
+        """ Queues an article, an already queued article only gets its new position in the listing"""
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO queue (href, title, url, position) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(href) DO UPDATE SET position = excluded.position",
+                (href, title, url, position),
+            )
+
+    def done_hrefs(self):
+        """ Hrefs of the articles that are already fetched"""
+
+        rows = self.connection.execute("SELECT href FROM queue WHERE status = 'done'")
+        return {href for href, in rows}
+
+    def pending(self):
+        """ (title, href, url) of the queued articles not fetched yet, in listing order"""
+
+        rows = self.connection.execute("SELECT title, href, url FROM queue WHERE status != 'done' ORDER BY position")
+        return rows.fetchall()
+
+    def save_article(self, href, record):
+        """ Stores the parsed article, it is committed before the next article is processed"""
+
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE queue SET status = 'done', record = ? WHERE href = ?", (json.dumps(record), href))
+
+    def mark_failed(self, href):
+        """ Articles that could not be fetched are retried when the update is restarted"""
+
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE queue SET status = 'failed' WHERE href = ?", (href,))
+
+    def failed_hrefs(self):
+        """ Hrefs of the articles that could not be fetched"""
+
+        rows = self.connection.execute("SELECT href FROM queue WHERE status = 'failed' ORDER BY position")
+        return [href for href, in rows]
+
+    def carry_over_failed(self, last_href):
+        """
+        Keeps only the failed articles for the next update, which starts from the new newest article last_href.
+        They are queued again after the articles that the next update finds on the listing pages.
+        """
+
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM queue WHERE status != 'failed'")
+            self.connection.execute("UPDATE queue SET status = 'pending', position = position + 1000000")
+            self.connection.execute("DELETE FROM meta")
+        self.set_meta("last_href", last_href)
+        self.connection.close()
+
+    def records(self):
+        """ The fetched articles in listing order (newest first) as dicts with title, href and url"""
+
+        rows = self.connection.execute("SELECT title, href, url, record FROM queue WHERE status = 'done' ORDER BY position")
+        return [dict(json.loads(record), title=title, href=href, url=url) for title, href, url, record in rows]
+
+    def remove(self):
+        """ Deletes the checkpoint after the articles are appended to the dataset"""
+
+        self.connection.close()
+        os.remove(self.path)
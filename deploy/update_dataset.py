@@ -1,29 +1,48 @@
 """
 The function takes the existing dataset and scrapes the non-existent events.
 It then adds them to the existing set and stores it again in the original place.
+The progress is checkpointed (see update_checkpoint.py), so an interrupted update resumes without refetching.
+Run from the deploy folder: python update_dataset.py update [--background]
 """
 
 
 import pandas as pd
 import re
 from tqdm import tqdm
-import streamlit as st
 import glob
 import airportsdata
 import pycountry
-import time
+import os
+import shutil
+import subprocess
+import sys
 
 from scraping_helpers import *
 from preprocessing_helpers import *
+from embedding_store import *
+from dataset_store import *
+from update_checkpoint import *
 
-def get_cities():
+BACKFILL_DIR = "../data/interim/backfill"
+UPDATE_LOG_PATH = "../data/interim/update.log"
+
+# Raw columns of a scraped article
+ARTICLE_COLUMNS = ["title", "href", "text", "time_author", "headline", "comment_authors", "comments", "occurrence", "url"]
+
+
+def get_cities(with_codes=False):
+    """ City names of the airports, with with_codes=True also the IATA codes of the airports in the same order"""
     airports = airportsdata.load('IATA')  # key is the IATA location code
     airport_cities = []
+    airport_codes = []
     for airport in airports:
         city = airports[airport]["city"]
         if len(city) > 2:
             airport_cities.append(city)
+            airport_codes.append(airport)
 
+    if with_codes:
+        return airport_cities, airport_codes
     return airport_cities
 
 def get_countries():
@@ -34,114 +53,38 @@ def get_countries():
 
 
 
-def update(path):
-    """ The function takes the filepath to the full dataset and then updates that dataset by scraping the new entries on the webiste"""
+def load_lexicons(download=True):
+    """ Loads the stopwords, the airport cities, the city and country names and the from/to gazetteer used by preprocess_articles"""
 
-    # Load the current available dataset
-    old_df = load_df(path)
+    # Ensure necessary NLTK resources are downloaded
+    if download:
+        nltk.download('stopwords');
+    stop_words = nltk.corpus.stopwords.words('english')
 
-    
-    # Read in the current (non-up-to-date) datset
-    print(f"Length of previous df: {len(old_df)}")
+    # Get a dictionary of cities and countries
+    cities, codes = get_cities(with_codes=True)
+    countries = get_countries()
 
-    # From the dataset read the href of the first row
-    last_href = old_df.iloc[0].href
+    # Extract city and country names
+    city_names = [remove_accented_chars(city.lower()) for city in cities]
+    country_names = [remove_accented_chars(country.lower()) for country in countries]
 
+    # Matcher for the from/to cities, built once
+    gazetteer = Gazetteer(cities, codes)
 
-    """ Scrape missing items """
+    return {"stop_words": stop_words, "cities": cities, "city_names": city_names, "country_names": country_names, "gazetteer": gazetteer}
 
-    # Entry
-    URL = "https://avherald.com"
-
-    # Scrape hrefs and titles
-    titles, hrefs = tqdm(get_new_titles_and_hrefs(URL, last_href), desc="Loading hrefs") # titles is a dict {title: href}
-
-    # Scrape titles, articles, comments unitl that href
-    texts = []
-    time_authors = []
-    headlines = []
-    comment_authors = []
-    comments = []
-    occurrences = []
-    urls = []
-
-    # Initialize the progress bar
-    counter = 0
-    update_length = len(titles)
-    progress_bar = st.progress(counter)
-    step = update_length / 100
-
-    for href in tqdm(hrefs, desc="Updating Dataset"):
-        # Update the counter for the progress bar
-        counter += 1
-        # Update the progress bar
-        progress_bar.progress(int(counter // step))
-
-        url = URL + href
-        page = load_page(url)
-        article_text, time_author = get_article(page)
-        headline_text, comment_authors_texts, comments_texts = get_comments(page)
-        occurrence = find_occurrence_type(headline_text)
-
-        texts.append(article_text)
-        time_authors.append(time_author)
-        headlines.append(headline_text)
-        comment_authors.append(comment_authors_texts)
-        comments.append(comments_texts)
-        occurrences.append(occurrence)
-        urls.append(url)
-
-        # Sleep for 1 second
-        time.sleep(1)
-
-
-    df = pd.DataFrame({
-        "title": titles,
-        "href": hrefs,
-        "text": texts,
-        "time_author": time_authors,
-        "headline": headlines,
-        "comment_authors": comment_authors,
-        "comments": comments,
-        "occurrence": occurrences,
-        "url": urls
-    })
-
-    
-
-    """ If there are no updates, return the old_df"""
-    if len(df) == 0:
-        print("Nothing to update")
 
-        ################################################
-        # Write the DataFrame to smaller csv-files
-        # Define the chunk size
-        chunk_size = 10000
-
-        # Calculate the number of chunks
-        num_chunks = len(old_df) // chunk_size + (1 if len(old_df) % chunk_size != 0 else 0)
-
-        # Loop through each chunk and write to a separate CSV file
-        for i in range(num_chunks):
-            start_row = i * chunk_size
-            end_row = (i + 1) * chunk_size
-            chunk_df = old_df.iloc[start_row:end_row]
-            chunk_df.to_csv(f'{path.rstrip("*.csv")}chunk_{i+1}.csv', sep=',', index=False, header=True, na_rep='NULL', encoding='utf-8')
-
-        # # Verification: Display the number of rows in each chunk
-        # for i in range(num_chunks):
-        #     chunk_df = pd.read_csv(f'../data/processed/chunk_{i+1}.csv')
-        #     print(f'chunk_{i+1}.csv shape: {chunk_df.shape}')
-        #################################################
-        st.write("updated from to")
-        return old_df
-    else:
-        # Print the number of new articles
-        print(f"{len(df)} new articles found")
+def preprocess_articles(df, lexicons=None):
+    """ 
+    Adds the derived columns (author, dates, normalized text, cities, countries, from/to, flight phase) to scraped articles.
+    The lexicons of load_lexicons are loaded if they are not given.
+    """
 
-
-
-    """Preprocess the update_df"""
+    if lexicons is None:
+        lexicons = load_lexicons()
+    stop_words, gazetteer = lexicons["stop_words"], lexicons["gazetteer"]
+    city_names, country_names = lexicons["city_names"], lexicons["country_names"]
 
     # Apply the function to each value in 'Input' column
     df["author"], df["created"], df["updated"] = zip(*df["time_author"].apply(get_author_and_time))
@@ -154,64 +97,232 @@ def update(path):
         return re.sub(r'[\n\r\t\s]+', ' ', text, flags=re.UNICODE)
     df["text"] = df["text"].apply(remove_linebreaks)
 
-    # Ensure necessary NLTK resources are downloaded
-    nltk.download('punkt');
-    stop_words = nltk.corpus.stopwords.words('english')
-
-    # Get a dictionary of cities and countries
-    cities = get_cities()
-    countries = get_countries()
-
-    # Extract city and country names
-    city_names = [remove_accented_chars(city.lower()) for city in cities]
-    country_names = [remove_accented_chars(country.lower()) for country in countries]
-
-    # Apply the preprocess_text function to each row in df["text"] with tqdm progress bar
-    tqdm.pandas(desc="Normalizing texts")  # This line enables tqdm support for Pandas apply function
-    df["normalized_text"], df["cities"], df["countries"] = zip(*df["text"].progress_apply(lambda x: preprocess_text(x, stop_words, city_names, country_names)))
+    # Normalize the whole text column at once
+    df["normalized_text"], df["cities"], df["countries"] = preprocess_texts(df["text"], stop_words, city_names, country_names)
 
     # Drop rows where there is no text
     df = df[df["text"].notna()]
 
     # Get from to
-    df["from"], df["to"] = zip(*df["text"].apply(lambda x: get_from_to_airport(x, cities)))
+    df["from"], df["to"] = zip(*df["text"].apply(gazetteer.from_to))
 
     # Assign the flight phase to each new row
     #df["flight_phase"] = df["text"].apply(assign_flight_phase)
     df["flight_phase"] = df.apply(lambda row: assign_flight_phase(row["title"], row["text"]), axis=1)
 
-    # Concatenate the update_df and the old_df:
-    df_new = pd.concat([df, old_df], ignore_index=True)
+    return df
+
+
+def update(path=DATASET_PATH, embed=True, base_url="https://avherald.com", max_workers=4, rate=1.0, checkpoint_path=CHECKPOINT_PATH, progress=None):
+    """ 
+    The function takes the path of the segmented dataset and then updates that dataset by scraping the new entries on the webiste.
+    The new articles are appended as a new segment, the existing segments are not read or rewritten.
+    With embed=True, the new articles are also added to the SentenceTransformer embedding store.
+    The articles are fetched by max_workers threads with at most 'rate' requests per second,
+    base_url can point to a local server with saved pages for testing.
+    Every fetched article is stored in the checkpoint at checkpoint_path, an interrupted update resumes from there.
+    progress is called with the number of loaded articles, e.g. by the update job polled by the Home page.
+    Returns the dataframe of the new articles, df.attrs["failed_hrefs"] lists the articles that could not be
+    fetched, they stay in the checkpoint and are retried by the next update.
+    """
+
+    # The manifest holds the href of the newest article in the dataset
+    manifest = read_manifest(path)
+    if manifest is None:
+        migrate_to_segments(path)
+        manifest = read_manifest(path)
+    last_href = manifest["newest_href"]
+    print(f"Newest article in the dataset: {last_href}")
 
-    # Remove all line breaks, tabs, etc.
-    df_new['text'] = df_new['text'].apply(lambda x: re.sub(r'[\n\r\t\s]+', ' ', x, flags=re.UNICODE))
 
-    # Reprocess from-to
-    df_new["from"], df_new["to"] = zip(*df_new["text"].apply(lambda x: get_from_to_airport(x, cities)))
+    """ Scrape missing items """
+
+    # Entry
+    URL = base_url
+
+    # Articles fetched by an interrupted update are taken from the checkpoint
+    checkpoint = UpdateCheckpoint(last_href, checkpoint_path)
+    checkpoint.acquire()
+    done_hrefs = checkpoint.done_hrefs()
+    if done_hrefs:
+        print(f"Resuming update: {len(done_hrefs)} articles already fetched")
+
+    # Scrape hrefs and titles: the listing pages are crawled while the articles are already fetched
+    listed = {}
+    def article_urls():
+        if checkpoint.listing_complete():
+            for title, href, url in checkpoint.pending():
+                listed[url] = (title, href)
+                yield url
+            return
+
+        for position, (title, href) in enumerate(iter_new_titles_and_hrefs(URL, last_href, rate=rate)):
+            checkpoint.enqueue(position, title, href, URL + href)
+            if href not in done_hrefs:
+                listed[URL + href] = (title, href)
+                yield URL + href
+        checkpoint.mark_listing_complete()
+
+        # Articles that failed in an earlier update are older than the listed ones and retried last
+        for title, href, url in checkpoint.pending():
+            if url not in listed:
+                listed[url] = (title, href)
+                yield url
+
+    # The number of new articles is only known at the end of the crawl, so the progress is shown as a count
+    counter = len(done_hrefs)
+
+    # The articles are fetched concurrently, the results arrive in the order of the listing
+    pages = fetch_pages(article_urls(), max_workers=max_workers, rate=rate)
+    for url, page in tqdm(pages, desc="Updating Dataset"):
+        title, href = listed[url]
+
+        # Update the progress counter
+        counter += 1
+        if progress is not None:
+            progress(counter)
 
+        # Articles that could not be fetched after all retries are skipped
+        if page is None:
+            checkpoint.mark_failed(href)
+            continue
 
-    ################################################
-    # Write the DataFrame to smaller csv-files
-    # Define the chunk size
-    chunk_size = 10000
+        # Parse the page once for all fields and store the article in the checkpoint right away
+        record = parse_article(page)
+        record["occurrence"] = find_occurrence_type(record["headline"])
+        checkpoint.save_article(href, record)
 
-    # Calculate the number of chunks
-    num_chunks = len(df_new) // chunk_size + (1 if len(df_new) % chunk_size != 0 else 0)
+    print(f"HTTP cache: {get_cache_stats()}")
 
-    # Loop through each chunk and write to a separate CSV file
-    for i in range(num_chunks):
-        start_row = i * chunk_size
-        end_row = (i + 1) * chunk_size
-        chunk_df = df_new.iloc[start_row:end_row]
-        chunk_df.to_csv(f'{path.rstrip("*.csv")}chunk_{i+1}.csv', sep=',', index=False, header=True, na_rep='NULL', encoding='utf-8')
 
-    # # Verification: Display the number of rows in each chunk
-    # for i in range(num_chunks):
-    #     chunk_df = pd.read_csv(f'../data/processed/chunk_{i+1}.csv')
-    #     print(f'chunk_{i+1}.csv shape: {chunk_df.shape}')
-    #################################################
+    df = pd.DataFrame(checkpoint.records(), columns=ARTICLE_COLUMNS)
+
+    # Articles that failed after all retries stay in the checkpoint and are retried by the next update
+    failed_hrefs = checkpoint.failed_hrefs()
+    if failed_hrefs:
+        print(f"{len(failed_hrefs)} articles could not be fetched, they are retried by the next update")
+
+    """ If there are no updates, return the empty df"""
+    if len(df) == 0:
+        print("Nothing to update")
+        if failed_hrefs:
+            checkpoint.carry_over_failed(last_href)
+        else:
+            checkpoint.remove()
+        df.attrs["failed_hrefs"] = failed_hrefs
+        return df
+    else:
+        # Print the number of new articles
+        print(f"{len(df)} new articles found")
+
+
+
+    """Preprocess the update_df"""
+    df = preprocess_articles(df)
+
+    # Append the new articles as a new segment of the dataset
+    append_segment(df, path)
+
+    # The articles are in the dataset now, a restart begins with a fresh checkpoint holding only the failed articles
+    if failed_hrefs:
+        checkpoint.carry_over_failed(read_manifest(path)["newest_href"])
+    else:
+        checkpoint.remove()
+
+    # Embed only the new articles for the SentenceTransformer search
+    if embed:
+        try:
+            update_embedding_store(df, load_sentence_transformer())
+        except ImportError:
+            print("sentence-transformers not installed, new articles will be embedded on the SentenceTransformer page")
 
     """ Done with updating """
     print("Update complete")
 
-    return df_new
+    df.attrs["failed_hrefs"] = failed_hrefs
+    return df
+
+
+def start_background_update(path=DATASET_PATH, log_path=UPDATE_LOG_PATH):
+    """ 
+    Starts the update in a separate process that keeps running independent of the Streamlit session.
+    The output is appended to log_path. Returns the process.
+    """
+
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "a") as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "update", "--path", path],
+            stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+    print(f"Update started in the background (pid {process.pid}), log: {log_path}")
+
+    return process
+
+
+def ingest_backfill(backfill_dir=BACKFILL_DIR, path=DATASET_PATH, embed=True, processes=1):
+    """ 
+    Ingests the article segments written by the Scrapy backfill spider (src/data/avherald_scraper).
+    Articles already in the dataset are skipped, the others are preprocessed and the dataset is
+    rewritten newest first, since a backfill can add articles older than the newest one.
+    Returns the number of new articles.
+    With processes > 1, large backfills are preprocessed on several processes (see preprocess_corpus.py).
+    """
+
+    files = sorted(glob.glob(os.path.join(backfill_dir, "*.parquet")))
+    if not files:
+        print(f"No backfill segments in {backfill_dir}")
+        return 0
+
+    scraped = pd.concat([pd.read_parquet(file) for file in files], ignore_index=True).drop_duplicates("href")
+
+    # Only the hrefs of the existing dataset are needed to find the new articles
+    existing_hrefs = set(load_dataset(path, columns=["href"]).href) if read_manifest(path) is not None else set()
+    df = scraped[~scraped.href.isin(existing_hrefs)].reset_index(drop=True)
+    print(f"{len(df)} of {len(scraped)} backfilled articles are new")
+
+    if len(df) > 0 and processes > 1:
+        # Imported here, preprocess_corpus itself imports this module
+        from preprocess_corpus import preprocess_parallel, REPROCESS_DIR
+        df = preprocess_parallel(df, processes)
+    elif len(df) > 0:
+        df = preprocess_articles(df)
+
+    if len(df) > 0:
+        dataset = pd.concat([df, load_dataset(path)], ignore_index=True) if existing_hrefs else df.copy()
+        dataset["created"] = pd.to_datetime(dataset["created"])
+        dataset = dataset.sort_values("created", ascending=False, na_position="last", kind="stable").reset_index(drop=True)
+        write_dataset(dataset, path)
+
+        # Only the new articles are missing from the embedding store
+        if embed:
+            try:
+                update_embedding_store(df, load_sentence_transformer())
+            except ImportError:
+                print("sentence-transformers not installed, new articles will be embedded on the SentenceTransformer page")
+
+    # The segments are ingested, remove them so they are not ingested twice
+    for file in files:
+        os.remove(file)
+    if len(df) > 0 and processes > 1:
+        shutil.rmtree(REPROCESS_DIR)
+
+    return len(df)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Update the Aviation Herald dataset")
+    parser.add_argument("command", choices=["update", "ingest-backfill"], help="'update' scrapes the new articles, 'ingest-backfill' ingests the segments of the Scrapy spider")
+    parser.add_argument("--path", default=DATASET_PATH)
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes preprocessing the backfill")
+    parser.add_argument("--background", action="store_true", help="Run the update in a detached process, the output goes to the update log")
+    args = parser.parse_args()
+
+    if args.command == "update" and args.background:
+        start_background_update(args.path)
+    elif args.command == "update":
+        update(args.path)
+    else:
+        ingest_backfill(path=args.path, processes=args.processes)
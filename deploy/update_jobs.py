@@ -0,0 +1,115 @@
+"""
+Registry of dataset update jobs, run on a worker thread of the Streamlit server instead of inside a script run.
+The registry is module-level, so all sessions see the same jobs and a page can poll the status of a job
+started in another session. When a job has committed new articles, the dataset version changes, the shared
+dataset and indexes are then rebuilt and the pages drop their stale session state with drop_stale_state.
+"""
+
+
+import itertools
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from dataset_store import *
+from update_dataset import update
+
+
+# Session state that belongs to one dataset version, dropped when the version changes.
+# The dataset and the indexes themselves are shared by all sessions (see shared_resources.py)
+DATASET_STATE_KEYS = ("search_text",)
+
+JOBS = {}
+_job_ids = itertools.count(1)
+_jobs_lock = threading.Lock()
+
+# Updates of the dataset are run one after the other
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="update-job")
+
+
+class UpdateJob:
+    """
+    Status of one dataset update: 'queued', 'running', 'done' or 'failed', plus the number of loaded articles
+    and of the articles that could not be fetched (retried by the next update)
+    """
+
+    def __init__(self, job_id, path):
+        self.id = job_id
+        self.path = path
+        self.status = "queued"
+        self.progress = 0
+        self.new_rows = None
+        self.failed = 0
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def set_progress(self, count):
+        self.progress = count
+
+    def run(self, **kwargs):
+        self.status = "running"
+        self.started = time.time()
+        try:
+            df = update(self.path, progress=self.set_progress, **kwargs)
+            self.new_rows = len(df)
+            self.failed = len(df.attrs.get("failed_hrefs", ()))
+            self.status = "done"
+        except Exception as error:
+            traceback.print_exc()
+            self.error = repr(error)
+            self.status = "failed"
+        self.finished = time.time()
+
+
+def start_update_job(path=DATASET_PATH, **kwargs):
+    """
+    Starts an update of the dataset at path on the worker thread and returns its job.
+    If an update of that dataset is already queued or running, that job is returned instead.
+    The keyword arguments are passed to update_dataset.update.
+    """
+
+    with _jobs_lock:
+        job = latest_job(path)
+        if job is not None and job.active:
+            return job
+
+        job = UpdateJob(next(_job_ids), path)
+        JOBS[job.id] = job
+        _executor.submit(job.run, **kwargs)
+
+    return job
+
+
+def get_job(job_id):
+    """ Returns the job with this id or None"""
+
+    return JOBS.get(job_id)
+
+
+def latest_job(path=DATASET_PATH):
+    """ Returns the most recent job for the dataset at path or None"""
+
+    jobs = [job for job in JOBS.values() if job.path == path]
+    return jobs[-1] if jobs else None
+
+
+def drop_stale_state(session_state, path=DATASET_PATH):
+    """
+    Drops the session state of the previous dataset version if the dataset version changed since the
+    last run of the session. Returns True if the state was dropped.
+    """
+
+    version = dataset_version(path)
+    if session_state.get("dataset_version") == version:
+        return False
+
+    for key in DATASET_STATE_KEYS:
+        session_state.pop(key, None)
+    session_state["dataset_version"] = version
+    return True
@@ -7,6 +7,13 @@ import scrapy
 
 
 class AvheraldScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # The raw fields of an article, the same as scraped by deploy/update_dataset.update
+    title = scrapy.Field()
+    href = scrapy.Field()
+    text = scrapy.Field()
+    time_author = scrapy.Field()
+    headline = scrapy.Field()
+    comment_authors = scrapy.Field()
+    comments = scrapy.Field()
+    occurrence = scrapy.Field()
+    url = scrapy.Field()
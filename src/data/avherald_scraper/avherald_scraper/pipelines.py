@@ -4,10 +4,67 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+import os
+from datetime import datetime, timezone
+
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Columns of the raw article segments
+ITEM_SCHEMA = pa.schema([
+    ("title", pa.string()),
+    ("href", pa.string()),
+    ("text", pa.string()),
+    ("time_author", pa.string()),
+    ("headline", pa.string()),
+    ("comment_authors", pa.list_(pa.string())),
+    ("comments", pa.list_(pa.string())),
+    ("occurrence", pa.string()),
+    ("url", pa.string()),
+])
 
 
 class AvheraldScraperPipeline:
+    """ Buffers the article items and writes them in batches as parquet segments to BACKFILL_DIR"""
+
+    def __init__(self, backfill_dir, batch_size):
+        self.backfill_dir = backfill_dir
+        self.batch_size = batch_size
+        self.items = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            backfill_dir=crawler.settings.get("BACKFILL_DIR"),
+            batch_size=crawler.settings.getint("BACKFILL_BATCH_SIZE", 500),
+        )
+
+    def open_spider(self, spider):
+        os.makedirs(self.backfill_dir, exist_ok=True)
+
+    def close_spider(self, spider):
+        self.write_batch(spider)
+
     def process_item(self, item, spider):
+        self.items.append(ItemAdapter(item).asdict())
+        if len(self.items) >= self.batch_size:
+            self.write_batch(spider)
         return item
+
+    def write_batch(self, spider):
+        if not self.items:
+            return
+
+        table = pa.Table.from_pylist(self.items, schema=ITEM_SCHEMA)
+        file_name = f"backfill_{datetime.now(timezone.utc):%Y%m%dT%H%M%S_%f}.parquet"
+
+        # Write to a temporary name first, only complete segments are picked up
+        path = os.path.join(self.backfill_dir, file_name)
+        pq.write_table(table, path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+
+        spider.logger.info(f"Wrote {table.num_rows} articles to {file_name}")
+        self.items = []
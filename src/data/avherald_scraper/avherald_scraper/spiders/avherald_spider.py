@@ -1,10 +1,85 @@
 import scrapy
 
+from avherald_scraper.items import AvheraldScraperItem
+
+
+def find_occurrence_type(headline):
+    """ Input is a string that is normally leaded by the occurrence type (same as in deploy/preprocessing_helpers.py)"""
+
+    if headline is None:
+        return None
+
+    # Split the headline at colons ":"
+    hl_parts = headline.split(":")
+
+    if len(hl_parts) > 1 and len(hl_parts[0]) < 20:
+        return hl_parts[0].strip().lower()
+    return None
+
+
+def element_text(selector):
+    """ All text of the element including its children, like BeautifulSoup's get_text()"""
+
+    return selector.xpath("string()").get()
+
 
 class AvheraldSpiderSpider(scrapy.Spider):
+    """ 
+    Backfill spider: follows the listing pagination and yields one item per article.
+    Run from src/data/avherald_scraper: scrapy crawl avherald_spider [-a last_href=/h?article=...]
+    With last_href, the crawl stops at that article (e.g. the newest one already in the dataset).
+    """
+
     name = "avherald_spider"
     allowed_domains = ["avherald.com"]
     start_urls = ["https://avherald.com"]
 
+    def __init__(self, last_href=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_href = last_href
+
+    def start_requests(self):
+        # Listing pages change with every new article and are never cached, only the article pages are
+        for url in self.start_urls:
+            yield scrapy.Request(url, callback=self.parse, meta={"dont_cache": True})
+
     def parse(self, response):
-        pass
+        """ Listing page: requests every article and the next listing page"""
+
+        for span in response.css("span.headline_avherald"):
+            href = span.xpath("ancestor::a[1]/@href").get()
+            if href is None:
+                continue
+            if href == self.last_href:
+                return # The rest is already in the dataset
+
+            yield response.follow(href, callback=self.parse_article, cb_kwargs={"title": element_text(span), "href": href})
+
+        next_page_href = response.xpath('//img[@src="/images/next.jpg"]/ancestor::a[1]/@href').get()
+        if next_page_href:
+            yield response.follow(next_page_href, callback=self.parse, meta={"dont_cache": True})
+
+    def parse_article(self, response, title, href):
+        """ Article page: extracts the same fields as scraping_helpers.parse_article"""
+
+        texts = response.css("span.sitetext")
+        article_text = element_text(texts[3]) if len(texts) > 3 else "xxx"
+
+        # The first 'time_avherald' is the article's time and author, the others belong to the comments
+        time_authors = response.css("span.time_avherald")
+        time_author = element_text(time_authors[0]) if time_authors else "yyy"
+
+        headline = response.css("span.headline_article")
+        headline_text = element_text(headline[0]) if headline else None
+
+        yield AvheraldScraperItem(
+            title=title,
+            href=href,
+            text=article_text,
+            time_author=time_author,
+            headline=headline_text,
+            comment_authors=[element_text(author) for author in time_authors[1:]],
+            comments=[element_text(comment) for comment in response.css("span.sitecomment")[:-1]],
+            occurrence=find_occurrence_type(headline_text),
+            url=response.url,
+        )